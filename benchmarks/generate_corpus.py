@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import zipfile
+
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from shared_libs.argparse_utils import SortingHelpFormatter  # noqa: E402
+
+# (root folder, image folder) pairs for every layout get_folder()/get_folder_from_names() recognizes
+LAYOUTS = [
+    ('OEBPS', 'images'),
+    ('OPS', 'Images'),
+    ('item', 'image'),
+    ('EPUB', 'Image'),
+    ('.', 'images'),
+]
+COVERS = ['named', 'duplicate', 'parent', 'page_cover', 'none', 'opf']
+PUBLISHERS = ['Bench Press', 'Synthetic Comics']
+PURCHASES = ['Kobo', 'Amazon']
+
+SCHEMA = """
+CREATE TABLE books (id INTEGER PRIMARY KEY, title TEXT, sort TEXT, author_sort TEXT, timestamp TIMESTAMP,
+                    pubdate TIMESTAMP, series_index REAL, last_modified TIMESTAMP, path TEXT, uuid TEXT,
+                    has_cover BOOL, isbn TEXT);
+CREATE TABLE authors (id INTEGER PRIMARY KEY, name TEXT);
+CREATE TABLE books_authors_link (id INTEGER PRIMARY KEY, book INTEGER, author INTEGER);
+CREATE TABLE publishers (id INTEGER PRIMARY KEY, name TEXT);
+CREATE TABLE books_publishers_link (id INTEGER PRIMARY KEY, book INTEGER, publisher INTEGER);
+CREATE TABLE series (id INTEGER PRIMARY KEY, name TEXT);
+CREATE TABLE books_series_link (id INTEGER PRIMARY KEY, book INTEGER, series INTEGER);
+CREATE TABLE tags (id INTEGER PRIMARY KEY, name TEXT);
+CREATE TABLE books_tags_link (id INTEGER PRIMARY KEY, book INTEGER, tag INTEGER);
+CREATE TABLE languages (id INTEGER PRIMARY KEY, lang_code TEXT);
+CREATE TABLE books_languages_link (id INTEGER PRIMARY KEY, book INTEGER, lang_code INTEGER, item_order INTEGER);
+CREATE TABLE ratings (id INTEGER PRIMARY KEY, rating INTEGER);
+CREATE TABLE books_ratings_link (id INTEGER PRIMARY KEY, book INTEGER, rating INTEGER);
+CREATE TABLE comments (id INTEGER PRIMARY KEY, book INTEGER, text TEXT);
+CREATE TABLE identifiers (id INTEGER PRIMARY KEY, book INTEGER, type TEXT, val TEXT);
+CREATE TABLE data (id INTEGER PRIMARY KEY, book INTEGER, format TEXT, uncompressed_size INTEGER, name TEXT);
+CREATE TABLE custom_columns (id INTEGER PRIMARY KEY, label TEXT, name TEXT, datatype TEXT, mark_for_delete BOOL,
+                             editable BOOL, display TEXT, is_multiple BOOL, normalized BOOL);
+CREATE TABLE custom_column_1 (id INTEGER PRIMARY KEY, value TEXT);
+CREATE TABLE books_custom_column_1_link (id INTEGER PRIMARY KEY, book INTEGER, value INTEGER);
+CREATE TABLE custom_column_2 (id INTEGER PRIMARY KEY, book INTEGER, value BOOL);
+INSERT INTO custom_columns VALUES (1, 'purchase_location', 'Purchase Location', 'text', 0, 1, '{}', 0, 1);
+INSERT INTO custom_columns VALUES (2, 'manga', 'Manga', 'bool', 0, 1, '{}', 0, 0);
+INSERT INTO tags VALUES (1, 'Manga');
+INSERT INTO languages VALUES (1, 'eng');
+"""
+
+CONTAINER = """<?xml version="1.0"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+ <rootfiles><rootfile full-path="{opf}" media-type="application/oebps-package+xml"/></rootfiles>
+</container>
+"""
+
+XHTML = '<html xmlns="http://www.w3.org/1999/xhtml"><body><img src="{src}"/></body></html>'
+
+
+def get_member(folder, name):
+    return name if folder == '.' else f"{folder}/{name}"
+
+
+def get_opf(images, image_prefix, cover):
+    manifest = [f'<item id="cover" href="{image_prefix}{cover}" media-type="image/jpeg" properties="cover-image"/>']
+    spine = []
+    for number, image in enumerate(images):
+        manifest.append(f'<item id="img{number}" href="{image_prefix}{image}" media-type="image/jpeg"/>')
+        manifest.append(f'<item id="p{number}" href="page{number:04d}.xhtml" media-type="application/xhtml+xml"/>')
+        spine.append(f'<itemref idref="p{number}"/>')
+    return ('<?xml version="1.0"?>\n<package xmlns="http://www.idpf.org/2007/opf" version="3.0">\n'
+            f"<manifest>{''.join(manifest)}</manifest>\n<spine>{''.join(spine)}</spine>\n</package>\n")
+
+
+def make_epub(path, layout, cover, pages, page_size, rng):
+    root_folder, image_folder = layout
+    image_path = get_member(root_folder, image_folder)
+    page_data = [rng.randbytes(page_size + rng.randrange(page_size // 4 + 1)) for _ in range(pages)]
+    images = [f"page{number:04d}.jpg" for number in range(pages)]
+
+    with zipfile.ZipFile(path, 'w') as zip_ref:
+        zip_ref.writestr('mimetype', 'application/epub+zip')
+        for image, data in zip(images, page_data):
+            zip_ref.writestr(f"{image_path}/{image}", data)
+
+        cover_data = page_data[0] if cover == 'duplicate' else rng.randbytes(page_size)
+        if cover in ['named', 'duplicate', 'opf']:
+            zip_ref.writestr(f"{image_path}/cover.jpg", cover_data)
+        elif cover == 'parent':
+            zip_ref.writestr(get_member(root_folder, 'cover.jpg'), cover_data)
+        elif cover == 'page_cover':
+            zip_ref.writestr(f"{image_path}/page_cover.jpg", cover_data)
+
+        opf_name = get_member(root_folder, 'content.opf')
+        if cover == 'opf':
+            zip_ref.writestr('META-INF/container.xml', CONTAINER.format(opf=opf_name))
+            for number, image in enumerate(images):
+                zip_ref.writestr(get_member(root_folder, f"page{number:04d}.xhtml"),
+                                 XHTML.format(src=f"{image_folder}/{image}"))
+            zip_ref.writestr(opf_name, get_opf(images, f"{image_folder}/", 'cover.jpg'))
+        else:
+            zip_ref.writestr(opf_name, '<package/>')
+        zip_ref.writestr(get_member(root_folder, 'stylesheet.css'), 'img { width: 100%; }')
+
+
+def make_library(library, volumes, pages=8, page_size=16 * 1024, volumes_per_series=10, seed=1):
+    rng = random.Random(seed)
+    library = Path(library)
+    library.mkdir(parents=True, exist_ok=True)
+    db_path = library.joinpath('metadata.db')
+    if db_path.exists():
+        db_path.unlink()
+
+    conn = sqlite3.connect(db_path)
+    conn.executescript(SCHEMA)
+    conn.executemany('INSERT INTO publishers VALUES (?, ?)', list(enumerate(PUBLISHERS, 1)))
+    conn.executemany('INSERT INTO custom_column_1 VALUES (?, ?)', list(enumerate(PURCHASES, 1)))
+
+    books = []
+    for book_id in range(1, volumes + 1):
+        series_number = (book_id - 1) // volumes_per_series + 1
+        volume = (book_id - 1) % volumes_per_series + 1
+        series = f"Bench Series {series_number:04d}"
+        author = f"Author {series_number % 50:02d}"
+        title = f"{series} Vol. {volume}"
+        folder = f"{author}/{title} ({book_id})"
+        layout = LAYOUTS[(book_id - 1) % len(LAYOUTS)]
+        cover = COVERS[(book_id - 1) // len(LAYOUTS) % len(COVERS)]
+
+        library.joinpath(folder).mkdir(parents=True, exist_ok=True)
+        make_epub(library.joinpath(folder, f"{title}.epub"), layout, cover, pages, page_size, rng)
+
+        stamp = f"2024-01-{book_id % 28 + 1:02d} 10:{book_id % 60:02d}:00+00:00"
+        conn.execute('INSERT INTO books VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                     (book_id, title, title, author, stamp, '2020-03-04 00:00:00+00:00', float(volume), stamp,
+                      folder, f"bench-{book_id}", 0, ''))
+        conn.execute('INSERT OR IGNORE INTO authors VALUES (?, ?)', (series_number % 50 + 1, author))
+        conn.execute('INSERT INTO books_authors_link (book, author) VALUES (?, ?)', (book_id, series_number % 50 + 1))
+        conn.execute('INSERT OR IGNORE INTO series VALUES (?, ?)', (series_number, series))
+        conn.execute('INSERT INTO books_series_link (book, series) VALUES (?, ?)', (book_id, series_number))
+        conn.execute('INSERT INTO books_publishers_link (book, publisher) VALUES (?, ?)',
+                     (book_id, series_number % len(PUBLISHERS) + 1))
+        conn.execute('INSERT INTO books_custom_column_1_link (book, value) VALUES (?, ?)',
+                     (book_id, series_number % len(PURCHASES) + 1))
+        conn.execute('INSERT INTO custom_column_2 (book, value) VALUES (?, 1)', (book_id,))
+        conn.execute('INSERT INTO books_tags_link (book, tag) VALUES (?, 1)', (book_id,))
+        conn.execute('INSERT INTO books_languages_link (book, lang_code, item_order) VALUES (?, 1, 0)', (book_id,))
+        conn.execute('INSERT INTO comments (book, text) VALUES (?, ?)',
+                     (book_id, f"<p>Synthetic volume {volume} of {series}.</p>"))
+        conn.execute('INSERT INTO data (book, format, uncompressed_size, name) VALUES (?, ?, ?, ?)',
+                     (book_id, 'EPUB', 0, title))
+        books.append({'id': book_id, 'series': series, 'volume': volume, 'layout': '/'.join(layout), 'cover': cover})
+    conn.commit()
+    conn.close()
+    return books
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(formatter_class=SortingHelpFormatter)
+    parser.add_argument('-o', '--output', required=True, help='Folder to create the synthetic Calibre library in')
+    parser.add_argument('-n', '--volumes', type=int, default=100, help='Number of volumes to generate')
+    parser.add_argument('--pages', type=int, default=8, help='Pages per volume')
+    parser.add_argument('--page_size', type=int, default=16 * 1024, help='Approximate bytes per page')
+    parser.add_argument('--volumes_per_series', type=int, default=10, help='Volumes per series')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed (same seed, same corpus)')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    generated = make_library(args.output, args.volumes, args.pages, args.page_size, args.volumes_per_series,
+                             args.seed)
+    size = sum(os.path.getsize(path) for path in Path(args.output).rglob('*.epub'))
+    print(f"Generated {len(generated)} volumes ({size} bytes) in {args.output}")
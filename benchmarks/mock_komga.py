@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+
+import argparse
+import base64
+import json
+import re
+import sys
+import threading
+import time
+import uuid
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from shared_libs.argparse_utils import SortingHelpFormatter  # noqa: E402
+
+LIBRARY_ID = 'bench-library'
+
+
+class MockKomga:
+    """
+    Minimal local stand-in for the Komga REST endpoints convert_for_komga.py uses.
+
+    Serves paginated series/books listings (with `sort=lastModified,desc` and the
+    `search_regex` filter), single series, per-series book listings and the
+    library list, and accepts scan/analyze/refresh and thumbnail upload POSTs.
+    Every request is recorded in `calls`.
+
+    With `credentials` set, requests must authenticate: Basic auth (at most
+    `basic_limit` times, counted in `basic_logins`) answers with a new session
+    token in `X-Auth-Token`, and requests carrying a known token are accepted.
+    `expire_sessions()` drops every token, as a server restart or session timeout would.
+    """
+
+    def __init__(self, series=None, books=None, libraries=None, latency=0.0, credentials=None, basic_limit=None,
+                 host='127.0.0.1', port=0):
+        """
+        Args:
+            series: Komga-shaped series entries (id, name, metadata.title, libraryId, lastModified).
+            books: Komga-shaped book entries (id, seriesId, metadata.number/title, lastModified).
+            libraries: Library entries (id, name, root); defaults to a single library.
+            latency: Seconds to sleep before answering each request.
+            credentials: Optional (username, password) every request must authenticate as.
+            basic_limit: Number of Basic-auth requests accepted before rejecting them (None for no limit).
+            host: Interface to listen on.
+            port: Port to listen on (0 picks a free one).
+        """
+        self.series = list(series or [])
+        self.books = list(books or [])
+        self.libraries = list(libraries or [{'id': LIBRARY_ID, 'name': 'Bench', 'root': '/books'}])
+        self.latency = latency
+        self.credentials = credentials
+        self.basic_limit = basic_limit
+        self.basic_logins = 0
+        self.sessions = set()
+        self.calls = []
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.thread = None
+
+    @classmethod
+    def from_corpus(cls, books, in_komga=0.5, **kwargs):
+        """
+        Builds a server that already holds a fraction of a generated corpus.
+
+        Args:
+            books: Book dicts returned by `generate_corpus.make_library`.
+            in_komga: Fraction of volumes (the lowest numbers of each series) Komga already has.
+            **kwargs: Passed to the constructor.
+        """
+        series = {}
+        komga_books = []
+        per_series = {}
+        for book in books:
+            per_series.setdefault(book['series'], []).append(book)
+        for number, (name, volumes) in enumerate(sorted(per_series.items())):
+            series_id = f"series-{number}"
+            series[name] = {'id': series_id, 'name': name, 'metadata': {'title': name}, 'libraryId': LIBRARY_ID,
+                            'lastModified': f"2024-01-01T00:00:{number % 60:02d}Z"}
+            for book in sorted(volumes, key=lambda entry: entry['volume'])[:round(len(volumes) * in_komga)]:
+                modified = f"2024-01-02T00:{book['id'] // 60 % 60:02d}:{book['id'] % 60:02d}Z"
+                komga_books.append({'id': f"book-{book['id']}", 'seriesId': series_id,
+                                    'metadata': {'number': str(book['volume']), 'title': f"Vol. {book['volume']}"},
+                                    'lastModified': modified})
+        return cls(list(series.values()), komga_books, **kwargs)
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def expire_sessions(self):
+        with self.lock:
+            self.sessions.clear()
+
+    def authenticate(self, headers):
+        """
+        Returns:
+            (status, new session token or None); status is 200 or 401.
+        """
+        if self.credentials is None:
+            return 200, None
+        with self.lock:
+            if headers.get('X-Auth-Token') in self.sessions:
+                return 200, None
+            scheme, _, encoded = headers.get('Authorization', '').partition(' ')
+            if scheme != 'Basic' or (self.basic_limit is not None and self.basic_logins >= self.basic_limit):
+                return 401, None
+            if tuple(base64.b64decode(encoded).decode().split(':', 1)) != tuple(self.credentials):
+                return 401, None
+            self.basic_logins += 1
+            token = uuid.uuid4().hex
+            self.sessions.add(token)
+            return 200, token
+
+    def listing(self, path, query):
+        if path == '/api/v1/series':
+            entries = self.series
+            if 'search_regex' in query:
+                pattern = re.compile(query['search_regex'][0].rsplit(',', 1)[0], re.IGNORECASE)
+                entries = [entry for entry in entries if pattern.search(entry['metadata']['title'])]
+        elif path == '/api/v1/books':
+            entries = self.books
+        else:
+            match = re.fullmatch(r'/api/v1/series/([^/]+)/books', path)
+            if not match:
+                return None
+            entries = [entry for entry in self.books if entry['seriesId'] == match.group(1)]
+
+        if query.get('sort', [''])[0].startswith('lastModified'):
+            entries = sorted(entries, key=lambda entry: entry['lastModified'], reverse=True)
+        size = int(query.get('size', ['20'])[0])
+        page = int(query.get('page', ['0'])[0])
+        total_pages = max(1, -(-len(entries) // size))
+        return {'content': entries[page * size:(page + 1) * size], 'totalElements': len(entries),
+                'totalPages': total_pages, 'number': page, 'last': page >= total_pages - 1}
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            token = None
+
+            def log_message(self, *args):
+                pass
+
+            def reply(self, status, body=None):
+                data = json.dumps(body).encode() if body is not None else b''
+                self.send_response(status)
+                if self.token:
+                    self.send_header('X-Auth-Token', self.token)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def check_auth(self):
+                status, self.token = mock.authenticate(self.headers)
+                if status != 200:
+                    self.reply(status)
+                return status == 200
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                with mock.lock:
+                    mock.calls.append(('GET', self.path))
+                time.sleep(mock.latency)
+                if not self.check_auth():
+                    return None
+                if url.path == '/api/v2/users/me':
+                    return self.reply(200, {'email': (mock.credentials or ['admin@example.org'])[0]})
+                if url.path == '/api/v1/libraries':
+                    return self.reply(200, mock.libraries)
+                match = re.fullmatch(r'/api/v1/series/([^/]+)', url.path)
+                if match:
+                    entry = next((entry for entry in mock.series if entry['id'] == match.group(1)), None)
+                    return self.reply(200 if entry else 404, entry)
+                body = mock.listing(url.path, parse_qs(url.query))
+                self.reply(200 if body is not None else 404, body)
+
+            def do_POST(self):
+                with mock.lock:
+                    mock.calls.append(('POST', self.path))
+                time.sleep(mock.latency)
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if self.check_auth():
+                    self.reply(202)
+
+        return Handler
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(formatter_class=SortingHelpFormatter)
+    parser.add_argument('--port', type=int, default=25600, help='Port to listen on')
+    parser.add_argument('--series', type=int, default=100, help='Number of series to serve')
+    parser.add_argument('--volumes', type=int, default=10, help='Volumes per series')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds of latency added to each request')
+    parser.add_argument('--user', help='Require this username (with --password) on every request')
+    parser.add_argument('--password', help='Password for --user')
+    parser.add_argument('--basic_limit', type=int, help='Reject Basic auth after this many logins')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    corpus = [{'id': number * args.volumes + volume, 'series': f"Bench Series {number + 1:04d}", 'volume': volume}
+              for number in range(args.series) for volume in range(1, args.volumes + 1)]
+    credentials = (args.user, args.password) if args.user else None
+    with MockKomga.from_corpus(corpus, in_komga=1.0, latency=args.latency, credentials=credentials,
+                               basic_limit=args.basic_limit, port=args.port) as server:
+        print(f"Mock Komga serving {len(server.series)} series, {len(server.books)} books on {server.base_url}")
+        try:
+            server.thread.join()
+        except KeyboardInterrupt:
+            pass
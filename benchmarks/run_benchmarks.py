@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import zipfile
+
+from contextlib import contextmanager, redirect_stdout
+from datetime import datetime, timezone
+from pathlib import Path
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import convert_for_komga as cfk  # noqa: E402
+from benchmarks.generate_corpus import make_library  # noqa: E402
+from benchmarks.mock_komga import MockKomga  # noqa: E402
+from shared_libs.argparse_utils import SortingHelpFormatter  # noqa: E402
+
+STAGES = {
+    'stream': ['metadata', 'komga_check', 'pages', 'comicinfo', 'cbz_write'],
+    'extract': ['metadata', 'komga_check', 'extraction', 'cover_check', 'comicinfo', 'cbz_write'],
+}
+results_folder = Path(__file__).resolve().parent.joinpath('results')
+
+
+@contextmanager
+def timed(timings, stage):
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + perf_counter() - start
+
+
+def get_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=Path(__file__).resolve().parents[1]).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def get_corpus(work_folder, volumes, pages, page_size, regenerate=False):
+    library = Path(work_folder).joinpath(f"corpus-{volumes}-{pages}x{page_size}")
+    manifest = library.joinpath('corpus.json')
+    if manifest.exists() and not regenerate:
+        return library, json.loads(manifest.read_text())
+    if library.exists():
+        shutil.rmtree(library)
+    print(f"Generating {volumes} volume corpus in {library}")
+    books = make_library(library, volumes, pages, page_size)
+    manifest.write_text(json.dumps(books))
+    return library, books
+
+
+def run_mode(mode, library, server, work_folder):
+    output_folder = Path(work_folder).joinpath(f"output-{mode}")
+    if output_folder.exists():
+        shutil.rmtree(output_folder)
+    output_folder.mkdir(parents=True)
+    index_file = output_folder.joinpath('komga_index.json')
+
+    cfk.library_path = library.as_posix()
+    cfk.calibre_metadata = None
+    cfk.komga_server = server.base_url
+    cfk.komga_client = None
+    cfk.komga_token_file = output_folder.joinpath('komga_token.json').as_posix()
+    cfk.komga_index = None
+    cfk.series_cache.clear()
+    cfk.folder_cache.clear()
+    cfk.skip_local = False
+    cfk.temp_folder = output_folder.joinpath('temp').as_posix() + '/'
+
+    timings = {}
+    statuses = {}
+    cwd = os.getcwd()
+    os.chdir(output_folder)
+    try:
+        with redirect_stdout(open(os.devnull, 'w')):
+            with timed(timings, 'metadata'):
+                calibre = cfk.dump_calibre()
+
+            with timed(timings, 'komga_check'):
+                cfk.komga_index = cfk.load_komga_index(index_file, 'bench', 'bench', True)
+                pending = []
+                for epub in sorted(library.rglob('*.epub')):
+                    book_data = calibre[cfk.get_book_id(epub)]
+                    series = cfk.get_manga_series(book_data)
+                    if cfk.check_komga(series, book_data['series_index'], 'bench', 'bench'):
+                        statuses['komga'] = statuses.get('komga', 0) + 1
+                    else:
+                        pending.append((epub, book_data, series))
+
+            for epub, book_data, series in pending:
+                status = (run_stream if mode == 'stream' else run_extract)(epub, book_data, series, timings)
+                statuses[status] = statuses.get(status, 0) + 1
+    finally:
+        os.chdir(cwd)
+        if cfk.komga_client is not None:
+            cfk.komga_client.close()
+    return timings, statuses
+
+
+def run_extract(epub, book_data, series, timings):
+    temp_folder = cfk.temp_folder
+    with timed(timings, 'extraction'):
+        with zipfile.ZipFile(epub, 'r') as zip_ref:
+            zip_ref.extractall(temp_folder)
+
+    with timed(timings, 'cover_check'):
+        root_folder, image_folder = cfk.get_folder(temp_folder)
+        extension = root_folder and cfk.get_extension(Path(temp_folder).joinpath(root_folder, image_folder))
+        cover_ok = extension and cfk.check_cover(Path(temp_folder).joinpath(root_folder, image_folder), extension)
+    if not cover_ok:
+        cfk.clean_folder(temp_folder)
+        return 'unrecognized' if not extension else 'failed'
+
+    with timed(timings, 'comicinfo'):
+        cfk.generate_comix(book_data)
+
+    with timed(timings, 'cbz_write'):
+        cfk.check_path(book_data['publisher'], series, book_data['series_index'], True)
+        cfk.generate_cbz(book_data, series, temp_folder, root_folder, image_folder, extension)
+    cfk.clean_folder(temp_folder)
+    return 'converted'
+
+
+def run_stream(epub, book_data, series, timings):
+    with zipfile.ZipFile(epub, 'r') as zip_ref:
+        with timed(timings, 'pages'):
+            status, pages = cfk.get_archive_pages(zip_ref)
+        if status != 'ok':
+            return status
+
+        with timed(timings, 'comicinfo'):
+            xml = cfk.build_comix(book_data)
+
+        with timed(timings, 'cbz_write'):
+            cfk.check_path(book_data['publisher'], series, book_data['series_index'], True)
+            cfk.stream_cbz(zip_ref, book_data, series, pages, xml)
+    return 'converted'
+
+
+def compare(baseline, current):
+    print(f"{'volumes':>8} {'mode':<8} {'stage':<12} {'baseline':>10} {'current':>10} {'change':>8}")
+    for size, modes in current['results'].items():
+        for mode, result in modes.items():
+            base = baseline['results'].get(size, {}).get(mode)
+            if not base:
+                continue
+            for stage in [*STAGES[mode], 'total']:
+                old = base['total'] if stage == 'total' else base['stages'].get(stage)
+                new = result['total'] if stage == 'total' else result['stages'].get(stage)
+                if old is None or new is None:
+                    continue
+                change = f"{(new - old) / old * 100:+.1f}%" if old else 'n/a'
+                print(f"{size:>8} {mode:<8} {stage:<12} {old:>10.4f} {new:>10.4f} {change:>8}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(formatter_class=SortingHelpFormatter)
+    parser.add_argument('-s', '--sizes', type=int, nargs='+', default=[10, 100, 1000],
+                        help='Corpus sizes (volumes) to benchmark')
+    parser.add_argument('-m', '--modes', nargs='+', choices=sorted(STAGES), default=sorted(STAGES),
+                        help='Conversion modes to benchmark')
+    parser.add_argument('--pages', type=int, default=8, help='Pages per synthetic volume')
+    parser.add_argument('--page_size', type=int, default=16 * 1024, help='Approximate bytes per page')
+    parser.add_argument('--in_komga', type=float, default=0.5,
+                        help='Fraction of volumes the mock Komga already holds')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds of latency added to each mock request')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per size/mode; the fastest stage times are kept')
+    parser.add_argument('-w', '--work_folder', default='./bench_work',
+                        help='Folder for generated corpora and output (corpora are reused between runs)')
+    parser.add_argument('--regenerate', action='store_true', help='Regenerate corpora even if they exist')
+    parser.add_argument('--label', help='Name of the result file (default: current git commit)')
+    parser.add_argument('-o', '--output', help='Result file to write (default: benchmarks/results/<label>.json)')
+    parser.add_argument('-c', '--compare', help='Earlier result file to compare against')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    label = args.label or get_commit()
+    report = {
+        'label': label,
+        'commit': get_commit(),
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {'pages': args.pages, 'page_size': args.page_size, 'in_komga': args.in_komga,
+                   'latency': args.latency, 'repeat': args.repeat},
+        'results': {},
+    }
+
+    for size in args.sizes:
+        library, books = get_corpus(args.work_folder, size, args.pages, args.page_size, args.regenerate)
+        report['results'][str(size)] = {}
+        for mode in args.modes:
+            best = {}
+            for _ in range(args.repeat):
+                with MockKomga.from_corpus(books, args.in_komga, latency=args.latency,
+                                           credentials=('bench', 'bench'), basic_limit=1) as server:
+                    timings, statuses = run_mode(mode, library, server, args.work_folder)
+                best = {stage: min(seconds, best.get(stage, seconds)) for stage, seconds in timings.items()}
+            total = sum(best.values())
+            report['results'][str(size)][mode] = {
+                'stages': {stage: round(best.get(stage, 0.0), 6) for stage in STAGES[mode]},
+                'total': round(total, 6),
+                'per_volume': round(total / size, 6),
+                'statuses': statuses,
+            }
+            stages = ', '.join(f"{stage} {best.get(stage, 0.0):.3f}s" for stage in STAGES[mode])
+            print(f"{size:>5} volumes, {mode:<7}: {total:.3f}s ({stages}) {statuses}")
+
+    output = Path(args.output) if args.output else results_folder.joinpath(f"{label}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=1) + '\n')
+    print(f"Results written to {output}")
+
+    if args.compare:
+        compare(json.loads(Path(args.compare).read_text()), report)
@@ -1,40 +1,135 @@
 #!/usr/bin/env python3
 
 import argparse
+import csv
 import datetime
 import hashlib
+import io
 import json
 import os
+import posixpath
 import re
-import requests
 import shutil
+import struct
 import sys
 import zipfile
 
 from argparse import HelpFormatter
-from datetime import date, datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager, redirect_stdout
+from datetime import date, datetime, time, timedelta, timezone
+from time import monotonic, sleep
+from functools import partial
 from operator import attrgetter
 from pathlib import Path
-from requests.auth import HTTPBasicAuth
-from subprocess import Popen, PIPE, STDOUT
+from subprocess import Popen, PIPE
+from urllib.parse import unquote
+from xml.etree import ElementTree
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+from shared_libs.calibre_metadata import CalibreMetadata
+from shared_libs.calibre_records import CalibreStore, iter_json_array
+from shared_libs.conversion_manifest import ConversionManifest
+from shared_libs.instrumentation import Metrics
+from shared_libs.komga_client import KomgaClient, KomgaError
+from shared_libs.komga_index import KomgaIndex, expand_number, normalize_name, normalize_number
+from shared_libs.library_watcher import LibraryWatcher
+from shared_libs.page_transcoder import FORMATS, PageTranscoder, make_thumbnail
+from shared_libs.sentry_bootstrap import init as sentry_init
 
 calibre_db = '/Applications/calibre.app/Contents/MacOS/calibredb'
 library_path = '/Users/saxx0n/Documents/Calibre/Calibre Manga Library v2'
+metadata_backend = 'sqlite'
+calibre_metadata = None
 
 DEBUG = False
+debug_level = 1
 temp_folder = './temp/'
+worker_calibre = None
 
 info_name = 'ComicInfo.xml'
 
+common_data = {
+    'Volume': 'series_index',
+    'Writer': 'authors',
+    'Publisher': 'publisher',
+    'Tags': 'tags',
+    'Count': '*total_volumes',
+    'AgeRating': '*age_rating',
+    'Penciller': '*penciller',
+    'Inker': '*inker',
+    'Imprint': '*imprint',
+    'Colorist': '*colorist',
+    'Letterer': '*letterer',
+    'CommunityRating': '*rating_cust',
+    'CoverArtist': '*cover_artist',
+    'Editor': '*editor',
+    'Translator': '*translator',
+    'Genre': '*genre',
+    'Web': '*web',
+    'ISBN': '*isbn'
+}
+comix_inputs = list(common_data.values()) + ['pubdate', 'comments', '*manga', 'title', 'series']
+
+calibre_lazy_fields = ['comments']
+calibre_fields = [field for field in dict.fromkeys(['id', 'title', 'authors', 'publisher', 'series', 'series_index',
+                                                    'timestamp', 'last_modified', 'formats', '*purchase_location']
+                                                   + comix_inputs)
+                  if field not in calibre_lazy_fields]
+
+extract_images = False
+image_suffixes = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
+zip_chunk_size = 1024 * 1024
+
 force_png = False
 
+transcode_format = None
+transcode_max_width = 1600
+transcode_max_height = 2560
+transcode_quality = 85
+transcode_workers = 0
+transcode_memory = 256
+page_transcoder = None
+
+thumbnail_size = 0
+thumbnail_batch = 20
+thumbnail_rate = 5.0
+thumbnails = {}
+
 skip_komga = False
 skip_local = False
 
+manifest_file = './conversion_state.db'
+
+plan_fields = ['book_id', 'epub', 'series', 'volume', 'status', 'pages', 'estimated_bytes', 'cbz']
+reconcile_fields = ['status', 'book_id', 'komga_id', 'series', 'volume', 'epub']
+work_list_statuses = ['missing', 'convert']
+retry_statuses = ['failed', 'missing', 'unrecognized']
+finished_statuses = ['converted', 'komga', 'local', 'unchanged']
+
 komga_server = 'komga.local'
+komga_timeout = 30
+komga_connections = 4
+komga_client = None
+komga_index_file = './komga_index.json'
+komga_token_file = './komga_token.json'
+komga_index = None
+komga_poll_interval = 5
+
+series_cache = {}
+folder_cache = {}
 
 series_replacements = {}
 
+watch_interval = 2
+watch_debounce = 5
+
+metrics = Metrics('convert_for_komga', debug_hook=lambda msg, level: debug(msg, level))
+
 
 class SortingHelpFormatter(HelpFormatter):
     def add_arguments(self, actions):
@@ -42,16 +137,59 @@ class SortingHelpFormatter(HelpFormatter):
         super(SortingHelpFormatter, self).add_arguments(actions)
 
 
-def call_api(remote_url, user, pw):
-    debug(f" Checking url: {remote_url}", 3)
-    r = requests.get(remote_url,
-                     auth=HTTPBasicAuth(user, pw.strip("'")))
-    if r.status_code == 200:
-        debug('API Returned 200', 3)
-        return r.text
-    else:
-        print('Error calling API')
-        exit(2)
+def add_thumbnail(book_data, data):
+    try:
+        with metrics.timer('thumbnail', items=1, bytes=len(data)):
+            thumbnails[get_touched(book_data)] = make_thumbnail(data, thumbnail_size)
+    except (OSError, RuntimeError, ValueError) as e:
+        print(f" Unable to generate thumbnail: {e}")
+
+
+def build_comix(book_record):
+    year = book_record['pubdate'].split('-')[0]
+    month = book_record['pubdate'].split('-')[1]
+    day = book_record['pubdate'].split('-')[2].split('T')[0]
+
+    debug(f"y: {year}, m: {month}, y: {day}", 3)
+
+    debug(f"Building {info_name}", 3)
+    xml = '<ComicInfo xmlns:xsd="http://www.w3.org/2001/XMLSchema" ' \
+          'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">\n'
+    for item in common_data:
+        if common_data[item] in book_record.keys() and book_record[common_data[item]]:
+            if item == 'Volume':
+                xml += f"   <{item}>{int(book_record[common_data[item]])}</{item}>\n"
+            elif isinstance(book_record[common_data[item]], list):
+                xml += f"   <{item}>{','.join(book_record[common_data[item]])}</{item}>\n"
+            elif item == 'Writer':
+                xml += f"   <{item}>{book_record[common_data[item]].split('&')[0].rstrip()}</{item}>\n"
+            else:
+                xml += f"   <{item}>{book_record[common_data[item]]}</{item}>\n"
+    xml += f"   <Year>{year}</Year>\n   <Month>{month}</Month>\n   <Day>{day}</Day>\n"
+
+    xml += f"   <Summary>{clean_summary(book_record['comments'])}</Summary>\n"
+
+    if book_record['*manga']:
+        xml += '   <Manga>YesAndRightToLeft</Manga>\n'
+        xml += '   <LanguageISO>ja</LanguageISO>\n'
+
+    number = get_book_number(book_record)
+    debug(f"Vol number is: {number}")
+    xml += f"   <Number>{number}</Number>\n"
+
+    title, series = get_series(book_record, number)
+    xml += f"   <Title>{title}</Title>\n"
+    xml += f"   <Series>{series}</Series>\n"
+
+    xml += '</ComicInfo>'
+
+    debug(f"XML:\n{xml}", 3)
+
+    return xml
+
+
+def call_api(path, user, pw, params=None):
+    return get_komga_client(user, pw).get_json(path, params)
 
 
 def check_cover(working_folder_path, image_extension):
@@ -80,10 +218,11 @@ def check_cover(working_folder_path, image_extension):
     debug(f"Cover: \"{Path(working_folder_path).joinpath(f'{cover_name}{image_extension}')}\"", 2)
 
     try:
-        first_file = sorted(os.listdir(Path(working_folder_path)))[0]
+        image_list = sorted(os.listdir(Path(working_folder_path)))
+        first_file = image_list[0]
         if first_file == f'{cover_name}{image_extension}':
             debug(' First file is cover, incrementing', 3)
-            first_file = sorted(os.listdir(Path(working_folder_path)))[1]
+            first_file = image_list[1]
         debug(f" First non-cover file: {first_file}", 3)
 
         if Path(Path(working_folder_path).joinpath(f'{cover_name}{image_extension}')) > \
@@ -95,9 +234,10 @@ def check_cover(working_folder_path, image_extension):
                 debug(' Unable to fix image naming')
                 return False
 
-        hash_cover = get_hash(Path(working_folder_path).joinpath(f'{cover_name}{image_extension}'))
-        hash_first = get_hash(Path(working_folder_path).joinpath(first_file))
-        if hash_cover == hash_first:
+        cover_path = Path(working_folder_path).joinpath(f'{cover_name}{image_extension}')
+        first_path = Path(working_folder_path).joinpath(first_file)
+        if os.path.getsize(cover_path) == os.path.getsize(first_path) and \
+                get_hash(cover_path) == get_hash(first_path):
             debug(" Cover matches first file, removing cover", 2)
             os.remove(Path(working_folder_path).joinpath(f'{cover_name}{image_extension}'))
         return True
@@ -107,17 +247,30 @@ def check_cover(working_folder_path, image_extension):
 
 
 def check_komga(series, volume, username, password):
-    if series in series_replacements.keys():
-        series_id = series_replacements[series]
-    else:
-        series_string = series.replace(' ', '%20')
-        series_id = find_series(series_string, series, username, password)
+    if komga_index is not None:
+        series_id = series_replacements.get(series) or komga_index.find_series(series)
         if not series_id:
-            debug(" Found no matches, not in komga")
+            debug(" Found no matches in index, not in komga")
             return False
+        debug(f" Series ID: {series_id}", 3)
+        volume_exists = komga_index.has_volume(series_id, volume)
+        debug(f"Volume exists: {volume_exists}", 3)
+        return volume_exists
+
+    if series not in series_cache:
+        with metrics.timer('series_resolve', items=1, description=series):
+            if series in series_replacements.keys():
+                series_id = series_replacements[series]
+            else:
+                series_id = find_series(series, username, password)
+            series_cache[series] = (series_id, find_volumes(series_id, username, password) if series_id else set())
+    series_id, volumes = series_cache[series]
+    if not series_id:
+        debug(" Found no matches, not in komga")
+        return False
 
     debug(f" Series ID: {series_id}", 3)
-    volume_exists = find_volume(series_id, volume, username, password)
+    volume_exists = normalize_number(volume) in volumes
     debug(f"Volume exists: {volume_exists}", 3)
     return volume_exists
 
@@ -133,20 +286,26 @@ def check_match(var, var_val, var_name):
 def check_path(purchase_source, name, vol, create):
     path = Path(purchase_source).joinpath(name.replace('/', '_')).joinpath(f"Volume {vol}.cbz")
     debug(f"Checking for file/path: '{path}'", 3)
-    if os.path.isdir(path.parents[0]):
-        if os.path.isfile(Path(path)):
+    folder = path.parents[0].as_posix()
+    if folder not in folder_cache:
+        folder_cache[folder] = set(os.listdir(folder)) if os.path.isdir(folder) else None
+    if folder_cache[folder] is not None:
+        if path.name in folder_cache[folder]:
             return False
         else:
             return True
     else:
-        if not create:
+        if create:
             debug('Folder not found, creating', 3)
-            os.makedirs(path.parents[0])
-            return True
+            os.makedirs(path.parents[0], exist_ok=True)
+            folder_cache[folder] = set()
+        return True
 
 
 def clean_folder(folder):
     debug(f" Cleaning up {folder}")
+    if not os.path.isdir(folder):
+        return
     if os.path.basename(__file__) in os.listdir(folder):
         print('!!! Would purge self, skipping cleanup !!!')
         debug(' ERROR: Directory to cleanup includes self.')
@@ -173,35 +332,151 @@ def clean_summary(temp_item):
     return temp_item
 
 
-def convert_calibre_data(data):
-    new_index = {}
+def convert_all(files, calibre_data, publisher, purchase, user, password, dry_run_inner, jobs=1, manifest=None,
+                touched=None, journal=None):
+    counts = {}
+    total = len(files)
+    record = manifest is not None and not dry_run_inner
+    journal = journal if record else None
+
+    finished = {book_id: status for book_id, status in manifest.journal_entries(journal).items()
+                if status in finished_statuses} if journal else {}
+    if finished:
+        print(f"Resuming interrupted run, {len(finished)} of {len(files)} volumes already done")
+
+    missing = [file for file, _ in files if not os.path.isfile(file)]
+    if missing:
+        print(f"{len(missing)} books not on disk, skipping them")
+        debug(f"Missing: {missing}", 2)
+        counts['missing'] = len(missing)
+        files = [entry for entry in files if entry[0] not in missing]
+
+    if manifest is not None:
+        pending = []
+        for file, book_id in files:
+            if int(book_id) in finished:
+                debug(f"Finished before the run was interrupted, skipping: {file}", 2)
+                counts['resumed'] = counts.get('resumed', 0) + 1
+                if touched is not None and finished[int(book_id)] == 'converted':
+                    touched.add(get_touched(calibre_data[book_id]))
+                continue
+            stat = os.stat(file)
+            if manifest.is_unchanged(book_id, stat.st_size, stat.st_mtime_ns):
+                debug(f"Unchanged since last conversion, skipping: {file}", 2)
+                counts['unchanged'] = counts.get('unchanged', 0) + 1
+            else:
+                pending.append((file, book_id))
+    else:
+        pending = files
+
+    series_cache.clear()
+    folder_cache.clear()
+    groups = get_series_groups(pending, calibre_data)
+    series_times = {}
+    if jobs <= 1:
+        for series, file, book_id in [(series, *entry) for series, entries in groups for entry in entries]:
+            epub = Path(file).as_posix()
+            start = monotonic()
+            try:
+                with metrics.timer('volume', items=1, description=epub):
+                    status = convert_manga(epub, calibre_data, publisher, purchase, user, password, dry_run_inner,
+                                           book_id)
+            except (Exception, SystemExit) as e:
+                print(f" Error converting {epub}: {e!r}")
+                status = 'failed'
+            series_times.setdefault(series, [0, 0.0])
+            series_times[series][0] += 1
+            series_times[series][1] += monotonic() - start
+            counts[status] = counts.get(status, 0) + 1
+            if record and status in ['converted', 'local']:
+                manifest.record(**get_manifest_entry(epub, calibre_data, book_id))
+            if touched is not None and status == 'converted':
+                touched.add(get_touched(calibre_data[book_id]))
+            if journal:
+                manifest.journal_record(journal, book_id, status)
+    else:
+        debug(f"Converting {len(pending)} volumes with {jobs} workers", 1)
+        settings = {
+            'DEBUG': DEBUG,
+            'debug_level': debug_level,
+            'extract_images': extract_images,
+            'komga_connections': komga_connections,
+            'komga_index': komga_index,
+            'komga_server': komga_server,
+            'komga_timeout': komga_timeout,
+            'komga_token_file': komga_token_file,
+            'skip_komga': skip_komga,
+            'temp_folder': temp_folder,
+            'transcode_format': transcode_format,
+            'transcode_max_width': transcode_max_width,
+            'transcode_max_height': transcode_max_height,
+            'transcode_quality': transcode_quality,
+            'transcode_workers': transcode_workers,
+            'transcode_memory': transcode_memory,
+            'thumbnail_size': thumbnail_size,
+        }
+        with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker,
+                                 initargs=(settings, calibre_data)) as pool:
+            futures = {pool.submit(convert_worker, Path(file).as_posix(), publisher, purchase, user, password,
+                                   dry_run_inner, record, book_id): (book_id, series)
+                       for series, entries in groups for file, book_id in entries}
+            for future in as_completed(futures):
+                book_id, series = futures[future]
+                status, output, entry, worker_metrics, worker_thumbnails = future.result()
+                metrics.merge(worker_metrics)
+                series_times.setdefault(series, [0, 0.0])
+                series_times[series][0] += 1
+                series_times[series][1] += worker_metrics.get('volume', {}).get('seconds', 0.0)
+                thumbnails.update(worker_thumbnails)
+                sys.stdout.write(output)
+                sys.stdout.flush()
+                counts[status] = counts.get(status, 0) + 1
+                if entry:
+                    manifest.record(**entry)
+                if touched is not None and status == 'converted':
+                    touched.add(get_touched(calibre_data[book_id]))
+                if journal:
+                    manifest.journal_record(journal, book_id, status)
+
+    if journal:
+        manifest.journal_clear(journal)
+
+    summary = ', '.join(f"{status or 'skipped'}: {count}" for status, count in sorted(counts.items(), key=str))
+    print(f"Processed {total} volumes ({summary})")
+    if series_times:
+        print_series_report(series_times)
+    return counts
+
+
+def convert_calibre_data(data, publisher='all', purchase='all', loader=None):
+    new_index = CalibreStore(calibre_fields, calibre_lazy_fields, loader)
     for item in data:
-        tmp_id = item['id']
-        new_index[str(tmp_id)] = {}
-        debug(f"Building key for item with ID: {tmp_id}", 3)
-
-        for element in item:
-            debug(f"Looking at sub-element: {element}", 3)
-            if element != 'id':
-                new_index[str(tmp_id)][element] = item[element]
-
-    debug(f"Rebuilt index: {new_index}", 3)
+        if publisher != 'all' and item.get('publisher') != publisher:
+            continue
+        if purchase != 'all' and item.get('*purchase_location') != purchase:
+            continue
+        debug(f"Storing item with ID: {item['id']}", 3)
+        new_index.add(item)
+
+    debug(f"Stored {len(new_index)} calibre records", 2)
     return new_index
 
 
-def convert_manga(epub, calibre_data, publisher, purchase, user=False, password=False, dry_run_inner=False):
+def convert_manga(epub, calibre_data, publisher, purchase, user=False, password=False, dry_run_inner=False,
+                  book_id=None):
     debug(f"Dry run mode: {dry_run_inner}")
     debug(f"Looking at file: {epub}", 3)
-    book_id = Path(epub).parents[0].name.rsplit(' (')[-1].rsplit(')')[0]
+    book_id = book_id or get_book_id(epub)
     debug('Extracting name/volume')
     debug(f"Book ID: {book_id}", 2)
+    if book_id not in calibre_data:
+        debug(f"Book {book_id} not in selected calibre data")
+        print(f"Skipping {epub}, does not match publisher/purchase filters")
+        return 'mismatch'
     book_data = calibre_data[book_id]
     debug(f"Book data: {book_data}", 3)
 
-    try:
-        manga_series = book_data['series'].replace(' Omnibus', '').replace(' & ', ' and ')
-    except KeyError:
-        manga_series = book_data['title']
+    manga_series = get_manga_series(book_data)
 
     debug(f"Name: {book_data['title']}", 2)
     debug(f"Series: {manga_series}", 2)
@@ -211,83 +486,113 @@ def convert_manga(epub, calibre_data, publisher, purchase, user=False, password=
         print(f"Looking at {manga_series}, Vol. {int(book_data['series_index'])} ({book_data['authors']})")
 
     if not check_match(publisher, book_data['publisher'], 'Publisher'):
-        return
+        return 'mismatch'
 
     if not check_match(purchase, book_data['*purchase_location'], 'Purchase Location'):
-        return
+        return 'mismatch'
 
     debug('Checking for already in komga')
     if not skip_komga:
-        if check_komga(manga_series, book_data['series_index'], user, password):
+        with metrics.timer('komga_check', items=1):
+            in_komga = check_komga(manga_series, book_data['series_index'], user, password)
+        if in_komga:
             debug('Manga already exists in Komga')
             print(' Manga already exists in Komga')
-            return
+            return 'komga'
 
     debug('Checking for existing extraction')
     if not skip_local:
-        if not check_path(book_data['publisher'], manga_series, book_data['series_index'], dry_run_inner):
+        if not check_path(book_data['publisher'], manga_series, book_data['series_index'], not dry_run_inner):
             debug('Manga already exists locally')
             print(' Manga already exists locally')
-            return
-
-    debug("Starting manga extraction")
-    with zipfile.ZipFile(epub, 'r') as zip_ref:
-        zip_ref.extractall(temp_folder)
-
-    debug('Determining folder structure')
-    root_folder, image_folder = get_folder(temp_folder)
-    debug(f"Main folder: '{root_folder}', images_folder: '{image_folder}'", 2)
-
-    debug('Determining image extension')
-    extension = get_extension(Path(temp_folder).joinpath(root_folder).joinpath(image_folder))
-    if not extension:
-        print('Unable to find extension')
-        clean_folder(temp_folder)
-        return
-    debug(f" Image format: '{extension}'", 2)
-
-    debug('Checking for Redundant cover')
-    if not check_cover(Path(temp_folder).joinpath(root_folder).joinpath(image_folder), extension):
-        print('Unable to process cover data')
-        debug(' Unable to process cover data')
-        clean_folder(temp_folder)
-        return
-
-    debug('Building Comic Info')
-    if not generate_comix(book_data):
-        print('Unable to build ComicInfo.xml')
-        debug(' Unable to build ComicInfo.xml')
-        clean_folder(temp_folder)
-        return
-
-    debug("Generating new cbz volume")
-    if not dry_run_inner:
-        generate_cbz(book_data, manga_series, temp_folder, root_folder, image_folder, extension)
+            return 'local'
+
+    if not extract_images:
+        return stream_manga(epub, book_data, manga_series, dry_run_inner)
+    return extract_manga(epub, book_data, manga_series, dry_run_inner)
+
+
+def convert_worker(epub, publisher, purchase, user, password, dry_run_inner, record=False, book_id=None):
+    output = io.StringIO()
+    entry = None
+    metrics.reset()
+    thumbnails.clear()
+    with redirect_stdout(output):
+        try:
+            with metrics.timer('volume', items=1, description=epub):
+                status = convert_manga(epub, worker_calibre, publisher, purchase, user, password, dry_run_inner,
+                                       book_id)
+            if record and status in ['converted', 'local']:
+                entry = get_manifest_entry(epub, worker_calibre, book_id)
+        except (Exception, SystemExit) as e:
+            print(f" Error converting {epub}: {e!r}")
+            status = 'failed'
+        finally:
+            clean_folder(temp_folder)
+    return status, output.getvalue(), entry, metrics.snapshot(), dict(thumbnails)
+
+
+def copy_raw_member(zip_in, info, zip_out, arcname=None):
+    out_info = zipfile.ZipInfo(arcname or info.filename, date_time=info.date_time)
+    for field in ['compress_type', 'comment', 'extra', 'create_system', 'create_version', 'extract_version',
+                  'volume', 'internal_attr', 'external_attr', 'CRC', 'compress_size', 'file_size']:
+        setattr(out_info, field, getattr(info, field))
+    out_info.flag_bits = info.flag_bits & ~0x08
+
+    zip_in.fp.seek(info.header_offset)
+    header = zip_in.fp.read(zipfile.sizeFileHeader)
+    name_length, extra_length = struct.unpack('<HH', header[26:30])
+    zip_in.fp.seek(info.header_offset + zipfile.sizeFileHeader + name_length + extra_length)
+
+    out_info.header_offset = zip_out.fp.tell()
+    zip_out.fp.write(out_info.FileHeader())
+    remaining = info.compress_size
+    while remaining:
+        chunk = zip_in.fp.read(min(remaining, zip_chunk_size))
+        if not chunk:
+            raise zipfile.BadZipFile(f"Truncated member {info.filename}")
+        zip_out.fp.write(chunk)
+        remaining -= len(chunk)
+    zip_out.filelist.append(out_info)
+    zip_out.NameToInfo[out_info.filename] = out_info
+    zip_out.start_dir = zip_out.fp.tell()
+
+
+@metrics.timed('calibre_metadata')
+def dump_calibre(limited=False, publisher='all', purchase='all', since=None, title=None):
+    if metadata_backend == 'sqlite':
+        return read_calibre(limited, publisher, purchase, since, title)
 
-    debug('Cleaning up temp folder')
-    clean_folder(temp_folder)
-
-    print(' Build complete')
-
-
-def dump_calibre(limited=False):
     debug('Dumping calibre data to local variable', 3)
-    command = f"{calibre_db} --library-path='{library_path}' list " \
-              '-f all ' \
-              '--for-machine'
+    command = [calibre_db, f"--library-path={library_path}", 'list', '-f', 'all', '--for-machine']
+    search = []
     if limited:
-        command += f" -s id:{limited}"
+        search.append(f"id:{limited}")
+    if title:
+        search.append(f"title:\"={title}\"")
+    if since:
+        search.append(f"last_modified:>={(since - timedelta(days=1)).date().isoformat()}")
+    if publisher != 'all':
+        search.append(f"publisher:\"={publisher}\"")
+    if purchase != 'all':
+        search.append(f"#purchase_location:\"={purchase}\"")
+    if search:
+        command += ['-s', ' and '.join(search)]
     debug(f"Calibre Command: {command}", 3)
-    p = Popen(command, shell=True, stdin=PIPE, stdout=PIPE, stderr=STDOUT)
-    tmp_calibre_data = json.loads(p.stdout.read().decode())
-    debug(f"Calibre data: {tmp_calibre_data}", 3)
+    p = Popen(command, stdout=PIPE)
+    if ijson is not None:
+        items = ijson.items(p.stdout, 'item', use_float=True)
+    else:
+        items = iter_json_array(p.stdout)
 
-    tmp_calibre_data = convert_calibre_data(tmp_calibre_data)
+    tmp_calibre_data = convert_calibre_data(items, publisher, purchase)
+    p.wait()
     return tmp_calibre_data
 
 
-def debug(msg='', debug_msg_level=1, out=sys.stdout):
+def debug(msg='', debug_msg_level=1, out=None):
     if DEBUG and debug_msg_level <= debug_level:
+        out = out or sys.stdout
         if msg != '':
             if debug_level > 1:
                 out.write(f"DEBUG[{debug_msg_level}]: {msg}")
@@ -296,9 +601,59 @@ def debug(msg='', debug_msg_level=1, out=sys.stdout):
         out.write('\n')
 
 
-def find_series(series_string, series, username, password):
-    url = f"https://{komga_server}/api/v1/series?search_regex={series_string}%2CTITLE"
-    id_full = json.loads(call_api(url, username, password))
+def extract_manga(epub, book_data, manga_series, dry_run_inner=False):
+    debug("Starting manga extraction")
+    try:
+        with metrics.timer('extraction', items=1, bytes=os.path.getsize(epub)):
+            with zipfile.ZipFile(epub, 'r') as zip_ref:
+                zip_ref.extractall(temp_folder)
+
+        debug('Determining folder structure')
+        root_folder, image_folder = get_folder(temp_folder)
+        debug(f"Main folder: '{root_folder}', images_folder: '{image_folder}'", 2)
+
+        debug('Determining image extension')
+        extension = get_extension(Path(temp_folder).joinpath(root_folder).joinpath(image_folder))
+        if not extension:
+            print('Unable to find extension')
+            return 'unrecognized'
+        debug(f" Image format: '{extension}'", 2)
+
+        debug('Checking for Redundant cover')
+        with metrics.timer('cover_check', items=1):
+            cover_ok = check_cover(Path(temp_folder).joinpath(root_folder).joinpath(image_folder), extension)
+        if not cover_ok:
+            print('Unable to process cover data')
+            debug(' Unable to process cover data')
+            return 'failed'
+
+        debug('Building Comic Info')
+        with metrics.timer('comicinfo', items=1):
+            comix_ok = generate_comix(book_data)
+        if not comix_ok:
+            print('Unable to build ComicInfo.xml')
+            debug(' Unable to build ComicInfo.xml')
+            return 'failed'
+
+        debug("Generating new cbz volume")
+        if not dry_run_inner:
+            with metrics.timer('cbz_write', items=1) as timer:
+                generate_cbz(book_data, manga_series, temp_folder, root_folder, image_folder, extension)
+                timer.add(bytes=os.path.getsize(get_cbz_path(book_data, manga_series)))
+            if thumbnail_size:
+                image_path = Path(temp_folder).joinpath(root_folder).joinpath(image_folder)
+                cover = sorted(image for image in os.listdir(image_path) if Path(image).suffix == extension)[0]
+                add_thumbnail(book_data, image_path.joinpath(cover).read_bytes())
+    finally:
+        debug('Cleaning up temp folder')
+        clean_folder(temp_folder)
+
+    print(' Build complete')
+    return 'converted'
+
+
+def find_series(series, username, password):
+    id_full = call_api('/api/v1/series', username, password, {'search_regex': f"{series},TITLE"})
     debug(f" API returned: {id_full}", 3)
     debug(f" Found {len(id_full['content'])} matching series", 3)
     if len(id_full['content']) == 0:
@@ -319,119 +674,110 @@ def find_series(series_string, series, username, password):
     return series_id
 
 
-def find_volume(series_id, volume, username, password):
-    url = f"https://{komga_server}/api/v1/series/{series_id}/books?size=400"
-    series_full = json.loads(call_api(url, username, password))
-    debug(f" API returned: {series_full}", 3)
-    debug(f" Found {len(series_full['content'])} volumes", 3)
-    for key in series_full['content']:
+def find_volumes(series_id, username, password):
+    series_books = get_komga_client(username, password).get_all(f"/api/v1/series/{series_id}/books")
+    debug(f" API returned: {series_books}", 3)
+    debug(f" Found {len(series_books)} volumes", 3)
+    volumes = set()
+    for key in series_books:
         debug(f" Looking at key: {key}", 3)
         debug(f"   Name: {key['metadata']['title']}", 3)
         debug(f"   Number: {key['metadata']['number']}", 3)
-        if ',' in key['metadata']['number']:
-            debug("    Combo volume detected ','", 3)
-            check_number = key['metadata']['number'].split(',')
-        elif '-' in key['metadata']['number']:
-            debug(f"     Combo volume detected '-' '{key['metadata']['number']}'", 3)
-            start, end = key['metadata']['number'].split('-')
-            debug(f"     Start: {start}, end: {int(end) + 1}")
-            check_number = [str(i) for i in range(int(start), int(end) + 1, 1)]
-        else:
-            debug("     Single volume detected", 3)
-            check_number = key['metadata']['number']
-        debug(f"      Checking against: {check_number}", 3)
-        if str(int(volume)) in check_number:
-            debug(' Found a match!', 3)
-            return True
-    debug(f'Looped all volumes and didnt find volume: {volume}')
-    return False
+        volumes |= expand_number(key['metadata']['number'])
+    debug(f"      Series covers: {sorted(volumes)}", 3)
+    return volumes
 
 
 def generate_cbz(book_data, manga_series, temp_folder_int, root_folder, image_folder, extension):
-    cbz_location = Path(book_data['publisher']).joinpath(
-        manga_series.replace('/', '_')).joinpath(f"Volume {book_data['series_index']}.cbz")
+    cbz_location = get_cbz_path(book_data, manga_series)
     debug(f" CBZ file: '{cbz_location}", 2)
-    with zipfile.ZipFile(cbz_location, 'w') as zip_ref:
-        for image in os.listdir(Path(temp_folder_int).joinpath(root_folder).joinpath(image_folder)):
-            if Path(image).suffix == extension:
-                # debug(f" Adding {image} to zip", 3)
-                # noinspection PyTypeChecker
-                zip_ref.write(Path(temp_folder_int).joinpath(root_folder).joinpath(image_folder).joinpath(image),
-                              arcname=image)
-        zip_ref.write(Path(temp_folder_int).joinpath(info_name), arcname=info_name)
+    image_path = Path(temp_folder_int).joinpath(root_folder).joinpath(image_folder)
+    with open_cbz(cbz_location) as zip_ref:
+        if transcode_format:
+            transcode_pages(zip_ref, [(image, get_zip_date(book_data), image_path.joinpath(image).stat().st_size,
+                                       partial(image_path.joinpath(image).read_bytes))
+                                      for image in sorted(os.listdir(image_path)) if Path(image).suffix == extension])
+        else:
+            for image in os.listdir(image_path):
+                if Path(image).suffix == extension:
+                    # debug(f" Adding {image} to zip", 3)
+                    # noinspection PyTypeChecker
+                    zip_ref.write(image_path.joinpath(image), arcname=image)
+        zip_ref.writestr(zipfile.ZipInfo(info_name, date_time=get_zip_date(book_data)),
+                         Path(temp_folder_int).joinpath(info_name).read_text())
 
 
 def generate_comix(book_record):
-    common_data = {
-        'Volume': 'series_index',
-        'Writer': 'authors',
-        'Publisher': 'publisher',
-        'Tags': 'tags',
-        'Count': '*total_volumes',
-        'AgeRating': '*age_rating',
-        'Penciller': '*penciller',
-        'Inker': '*inker',
-        'Imprint': '*imprint',
-        'Colorist': '*colorist',
-        'Letterer': '*letterer',
-        'CommunityRating': '*rating_cust',
-        'CoverArtist': '*cover_artist',
-        'Editor': '*editor',
-        'Translator': '*translator',
-        'Genre': '*genre',
-        'Web': '*web',
-        'ISBN': '*isbn'
-    }
+    xml = build_comix(book_record)
 
-    year = book_record['pubdate'].split('-')[0]
-    month = book_record['pubdate'].split('-')[1]
-    day = book_record['pubdate'].split('-')[2].split('T')[0]
+    with open(Path(temp_folder).joinpath(info_name), 'w') as outfile:
+        outfile.write(xml)
 
-    debug(f"y: {year}, m: {month}, y: {day}", 3)
+    return True
 
-    debug(f"Building {info_name}", 3)
-    xml = '<ComicInfo xmlns:xsd="http://www.w3.org/2001/XMLSchema" ' \
-          'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">\n'
-    for item in common_data:
-        if common_data[item] in book_record.keys() and book_record[common_data[item]]:
-            if item == 'Volume':
-                xml += f"   <{item}>{int(book_record[common_data[item]])}</{item}>\n"
-            elif isinstance(book_record[common_data[item]], list):
-                xml += f"   <{item}>{','.join(book_record[common_data[item]])}</{item}>\n"
-            elif item == 'Writer':
-                xml += f"   <{item}>{book_record[common_data[item]].split('&')[0].rstrip()}</{item}>\n"
-            else:
-                xml += f"   <{item}>{book_record[common_data[item]]}</{item}>\n"
-    xml += f"   <Year>{year}</Year>\n   <Month>{month}</Month>\n   <Day>{day}</Day>\n"
 
-    xml += f"   <Summary>{clean_summary(book_record['comments'])}</Summary>\n"
+def get_archive_pages(zip_ref):
+    debug('Reading page order from OPF')
+    pages = get_opf_pages(zip_ref)
+    if pages:
+        return 'ok', pages
 
-    if book_record['*manga']:
-        xml += '   <Manga>YesAndRightToLeft</Manga>\n'
-        xml += '   <LanguageISO>ja</LanguageISO>\n'
+    debug('No usable OPF, determining folder structure')
+    names = zip_ref.namelist()
+    root_folder, image_folder = get_folder_from_names(names)
+    if not root_folder:
+        return 'unrecognized', 'Unable to determine folder layout'
+    debug(f"Main folder: '{root_folder}', images_folder: '{image_folder}'", 2)
+    image_prefix = get_member_prefix(root_folder, image_folder)
 
+    debug('Determining image extension')
+    extension = get_extension_from_names(names, image_prefix)
+    if not extension:
+        return 'unrecognized', 'Unable to find extension'
+    debug(f" Image format: '{extension}'", 2)
+
+    debug('Checking for Redundant cover')
+    pages = get_stream_pages(zip_ref, image_prefix, extension)
+    if not pages:
+        return 'failed', 'Unable to process cover data'
+    return 'ok', pages
+
+
+def get_book_id(epub):
+    return Path(epub).parents[0].name.rsplit(' (')[-1].rsplit(')')[0]
+
+
+def get_book_number(book_record):
     try:
         book_num = book_record['title'].split(' Vol.')[1].split(' (Manga)')[0]
         debug(f"book_num: {book_num}", 3)
     except IndexError:
         book_num = 'NONE'
 
-    number = get_number(book_num, book_record)
-    debug(f"Vol number is: {number}")
-    xml += f"   <Number>{number}</Number>\n"
+    return get_number(book_num, book_record)
 
-    title, series = get_series(book_record, number)
-    xml += f"   <Title>{title}</Title>\n"
-    xml += f"   <Series>{series}</Series>\n"
 
-    xml += '</ComicInfo>'
+def get_calibre_metadata():
+    global calibre_metadata
+    if calibre_metadata is None:
+        debug(f"Reading calibre metadata.db from: {library_path}", 3)
+        calibre_metadata = CalibreMetadata(library_path, debug_hook=debug)
+    return calibre_metadata
 
-    debug(f"XML:\n{xml}", 3)
 
-    with open(Path(temp_folder).joinpath(info_name), 'w') as outfile:
-        outfile.write(xml)
+def get_calibre_row(status, book_id, book_data):
+    epubs = [book_format for book_format in book_data['formats'] if book_format.endswith('.epub')]
+    return {'status': status, 'book_id': book_id, 'komga_id': '', 'series': get_manga_series(book_data),
+            'volume': normalize_number(book_data['series_index']), 'epub': epubs[0] if epubs else ''}
 
-    return True
+
+def get_cbz_path(book_data, manga_series):
+    return Path(book_data['publisher']).joinpath(
+        manga_series.replace('/', '_')).joinpath(f"Volume {book_data['series_index']}.cbz")
+
+
+def get_comix_inputs(book_record):
+    return {field: book_record.get(field) for field in comix_inputs}
 
 
 def get_extension(basename):
@@ -461,6 +807,33 @@ def get_extension(basename):
         return False
 
 
+def get_extension_from_names(names, image_prefix):
+    debug(f" Looking at archive folder: '{image_prefix}'", 3)
+    extension_list = []
+    for name in names:
+        if not name.startswith(image_prefix) or '/' in name[len(image_prefix):]:
+            continue
+        suffix = Path(name).suffix
+        if suffix not in extension_list:
+            extension_list.append(suffix)
+
+    for extension in ['', '.css', '.ncx', '.html', '.opf', '.xhtml']:
+        if extension in extension_list:
+            debug(f" Cleaning bad entry: {extension}", 3)
+            extension_list.remove(extension)
+
+    if force_png:
+        extension_list.remove('.jpeg')
+        extension_list.remove('.gif')
+
+    debug(f"Extension: {extension_list}")
+
+    if len(extension_list) == 1:
+        return extension_list[0]
+    else:
+        return False
+
+
 def get_folder(manga_file):
     if os.path.isdir(Path(manga_file).joinpath('OEBPS')):
         root_dir = 'OEBPS'
@@ -498,15 +871,168 @@ def get_folder(manga_file):
     return root_dir, images_dir
 
 
+def get_folder_from_names(names):
+    folders = set()
+    for name in names:
+        parts = name.split('/')[:-1]
+        for i in range(1, len(parts) + 1):
+            folders.add('/'.join(parts[:i]))
+
+    for root_dir in ['OEBPS', 'OPS', 'item', 'EPUB']:
+        if root_dir in folders:
+            break
+    else:
+        if 'images' in folders or 'image' in folders:
+            root_dir = '.'
+        elif len([name for name in names if name.endswith('.jpg')]) > 30:
+            return '.', '.'
+        elif len([name for name in names if name.endswith('.png')]) > 30:
+            return '.', '.'
+        else:
+            debug('Unable to determine main-folder layout')
+            return False, False
+
+    debug(f"Root folder: {root_dir}", 3)
+
+    for images_dir in ['images', 'Images', 'image', 'Image']:
+        if get_member_prefix(root_dir, images_dir).rstrip('/') in folders:
+            debug(f"Image Folder: {images_dir}", 3)
+            return root_dir, images_dir
+
+    debug('Unable to determine sub-folder layout')
+    return False, False
+
+
+def get_folder_list(raw_calibre, folder_path):
+    tmp_list = []
+    folder_path = Path(folder_path)
+
+    debug(f"Looking for books under: {folder_path}", 2)
+    for item in raw_calibre:
+        for book_format in raw_calibre[item]['formats']:
+            if not book_format.endswith('.epub') or not Path(book_format).is_relative_to(folder_path):
+                continue
+            if os.path.isfile(book_format):
+                tmp_list.append((book_format, item))
+            else:
+                debug(f"Listed in calibre but missing on disk: {book_format}", 1)
+
+    debug(f"Found {len(tmp_list)} mangas", 1)
+    debug(f"Item list: {tmp_list}", 3)
+    return tmp_list
+
+
 def get_hash(filename):
     debug(f" Generating Hash for: {filename}", 3)
     hasher = hashlib.sha512()
-    with open(filename, 'rb') as f:
-        buf = f.read()
-        hasher.update(buf)
-        a = hasher.hexdigest()
-        debug(f"  Hash computed as: {a}", 3)
-        return a
+    with metrics.timer('hash', items=1, bytes=os.path.getsize(filename)), open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(zip_chunk_size), b''):
+            hasher.update(chunk)
+    a = hasher.hexdigest()
+    debug(f"  Hash computed as: {a}", 3)
+    return a
+
+
+def get_journal_name(args, since):
+    if args.root_folder is not None:
+        selection = f"root:{args.root_folder}"
+    elif args.work_list:
+        selection = f"list:{args.work_list}"
+    elif since is not None:
+        selection = f"since:{since.isoformat()}"
+    else:
+        return None
+    return f"run:{args.publisher}:{args.purchase}:{selection}"
+
+
+def get_komga_client(username, password):
+    global komga_client
+    if komga_client is None:
+        debug(f"Opening Komga session to: {komga_server}", 2)
+        base_url = komga_server if '://' in komga_server else f"https://{komga_server}"
+        komga_client = KomgaClient(base_url, username, password, timeout=komga_timeout,
+                                   concurrency=komga_connections, token_file=komga_token_file or None,
+                                   debug_hook=debug)
+    return komga_client
+
+
+def get_komga_library(libraries, publisher):
+    for library in libraries:
+        if library.get('name') == publisher or Path(library.get('root', '')).name == publisher:
+            return library['id']
+    if len(libraries) == 1:
+        return libraries[0]['id']
+    return None
+
+
+def get_komga_row(status, series_id, number, komga_id):
+    return {'status': status, 'book_id': '', 'komga_id': komga_id, 'series': komga_index.series[series_id]['name'],
+            'volume': number, 'epub': ''}
+
+
+def get_manga_list(raw_calibre, manga):
+    tmp_list = []
+    if not raw_calibre:
+        print(f"No Calibre book matches '{manga}'")
+    elif len(raw_calibre) > 1:
+        print(f"Found {len(raw_calibre)} books matching '{manga}', converting all of them")
+
+    for item in raw_calibre:
+        epubs = [book_format for book_format in raw_calibre[item]['formats'] if book_format.endswith('.epub')]
+        if epubs and os.path.isfile(epubs[0]):
+            tmp_list.append((epubs[0], item))
+        else:
+            print(f"No epub on disk for {raw_calibre[item]['title']}")
+    return tmp_list
+
+
+def get_manga_query(manga):
+    if manga.isdigit():
+        return manga, None
+    if manga.endswith('.epub') or os.path.isfile(manga):
+        book_id = get_book_id(manga)
+        if not book_id.isdigit():
+            print(f"Not a Calibre book path (expected '.../Title (id)/book.epub'): {manga}")
+            sys.exit(1)
+        return book_id, None
+    return None, manga
+
+
+def get_manga_series(book_data):
+    try:
+        return book_data['series'].replace(' Omnibus', '').replace(' & ', ' and ')
+    except KeyError:
+        return book_data['title']
+
+
+def get_manifest_entry(epub, calibre_data, book_id=None):
+    book_id = book_id or get_book_id(epub)
+    book_data = calibre_data[book_id]
+    cbz_path = get_cbz_path(book_data, get_manga_series(book_data))
+    stat = os.stat(epub)
+    return {
+        'book_id': int(book_id),
+        'epub_path': Path(epub).as_posix(),
+        'epub_size': stat.st_size,
+        'epub_mtime_ns': stat.st_mtime_ns,
+        'cbz_path': cbz_path.as_posix(),
+        'cbz_hash': get_hash(cbz_path) if os.path.isfile(cbz_path) else None,
+        'comicinfo_inputs': get_comix_inputs(book_data),
+    }
+
+
+def get_member_hash(zip_ref, info):
+    debug(f" Generating Hash for member: {info.filename}", 3)
+    hasher = hashlib.sha512()
+    with zip_ref.open(info) as f:
+        for chunk in iter(lambda: f.read(zip_chunk_size), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def get_member_prefix(root_folder, image_folder):
+    prefix = '/'.join(part for part in (root_folder, image_folder) if part != '.')
+    return f"{prefix}/" if prefix else ''
 
 
 def get_number(in_number, record):
@@ -528,6 +1054,77 @@ def get_number(in_number, record):
     return number
 
 
+def get_opf_image(zip_ref, page_name):
+    try:
+        page = zip_ref.read(page_name).decode('utf-8', errors='replace')
+    except KeyError:
+        return None
+    match = re.search(r'<(?:\w+:)?(?:img|image)\b[^>]*?\s(?:src|xlink:href|href)\s*=\s*["\']([^"\']+)["\']', page)
+    if not match:
+        return None
+    return resolve_href(page_name, match.group(1))
+
+
+def get_opf_pages(zip_ref):
+    try:
+        container = ElementTree.fromstring(zip_ref.read('META-INF/container.xml'))
+        opf_name = container.find('.//{*}rootfile').get('full-path')
+        opf = ElementTree.fromstring(zip_ref.read(opf_name))
+    except (KeyError, AttributeError, ElementTree.ParseError) as e:
+        debug(f" Unable to read OPF: {e}", 2)
+        return False
+
+    items = {}
+    cover_name = None
+    for item in opf.iterfind('.//{*}manifest/{*}item'):
+        name = resolve_href(opf_name, item.get('href', ''))
+        items[item.get('id')] = (name, item.get('media-type', ''))
+        if 'cover-image' in item.get('properties', '').split():
+            cover_name = name
+    if not cover_name:
+        meta = opf.find(".//{*}metadata/{*}meta[@name='cover']")
+        if meta is not None and meta.get('content') in items:
+            cover_name = items[meta.get('content')][0]
+    if cover_name and not cover_name.lower().endswith(image_suffixes):
+        cover_name = None
+    debug(f" OPF cover: {cover_name}", 3)
+
+    page_names = []
+    for itemref in opf.iterfind('.//{*}spine/{*}itemref'):
+        name, media_type = items.get(itemref.get('idref'), (None, ''))
+        if not name:
+            continue
+        if not media_type.startswith('image/'):
+            name = get_opf_image(zip_ref, name)
+        if name and name in zip_ref.NameToInfo and name not in page_names:
+            page_names.append(name)
+    debug(f" OPF spine resolved to {len(page_names)} images", 3)
+    if not page_names:
+        return False
+
+    if cover_name in zip_ref.NameToInfo and cover_name != page_names[0]:
+        if cover_name in page_names:
+            page_names.remove(cover_name)
+        if not members_match(zip_ref, zip_ref.getinfo(cover_name), zip_ref.getinfo(page_names[0])):
+            page_names.insert(0, cover_name)
+        else:
+            debug(" Cover matches first page, dropping cover", 2)
+
+    width = max(3, len(str(len(page_names))))
+    return [(zip_ref.getinfo(name), f"{number:0{width}d}{Path(name).suffix.lower()}")
+            for number, name in enumerate(page_names)]
+
+
+def get_page_transcoder():
+    global page_transcoder
+    if page_transcoder is None:
+        debug(f"Transcoding pages to {transcode_format} (max {transcode_max_width}x{transcode_max_height})", 2)
+        page_transcoder = PageTranscoder(transcode_format, transcode_max_width, transcode_max_height,
+                                         transcode_quality, transcode_workers, transcode_memory * 1024 * 1024,
+                                         debug_hook=debug)
+    return page_transcoder
+
+
 def get_series(record, in_number):
     if 'series' in record.keys():
         debug('Series name', 3)
@@ -547,46 +1144,526 @@ def get_series(record, in_number):
     return title, series
 
 
-def get_today_list(raw_calibre):
+def get_series_groups(files, calibre_data):
+    groups = {}
+    for file, book_id in files:
+        book_data = calibre_data[book_id] if book_id in calibre_data else None
+        series = get_manga_series(book_data) if book_data is not None else ''
+        groups.setdefault(normalize_name(series), (series, []))[1].append((file, book_id))
+
+    debug(f"Grouped {len(files)} volumes into {len(groups)} series", 2)
+    return [(series, sorted(entries, key=lambda entry: float(calibre_data[entry[1]]['series_index'] or 0)
+                            if entry[1] in calibre_data else 0.0))
+            for _, (series, entries) in sorted(groups.items())]
+
+
+def get_series_library(client, series_id):
+    if not series_id:
+        return None
+    if komga_index is not None:
+        return komga_index.series.get(series_id, {}).get('library_id')
+    try:
+        return client.get_json(f"/api/v1/series/{series_id}").get('libraryId')
+    except KomgaError as e:
+        debug(f" Unable to look up series {series_id}: {e}")
+        return None
+
+
+def get_since_list(raw_calibre, since, fields=('timestamp', 'last_modified')):
     tmp_list = []
 
-    today = date.today()
-    debug(f"Today's date: {today}", 2)
+    debug(f"Looking for books with {'/'.join(fields)} since: {since}", 2)
     for item in raw_calibre:
         debug(f"Checking {raw_calibre[item]['title']}", 3)
-        debug(f"Timestamp: {raw_calibre[item]['timestamp']}", 3)
-        timestamp = datetime.strptime(raw_calibre[item]['timestamp'], "%Y-%m-%dT%H:%M:%S+00:00").date()
-        debug(f"Conversion timestamp: {timestamp}", 3)
-        if timestamp >= today:
+        stamps = [parse_timestamp(raw_calibre[item][field]) for field in fields if raw_calibre[item].get(field)]
+        debug(f"Timestamps: {stamps}", 3)
+        if any(stamp >= since for stamp in stamps):
             debug(f"Found {raw_calibre[item]['title']}", 2)
             for format in raw_calibre[item]['formats']:
                 if ".epub" in format:
-                    tmp_list.append(format)
+                    tmp_list.append((format, item))
 
     debug(f"Found {len(tmp_list)} mangas", 1)
     debug(f"Item list: {tmp_list}", 3)
     return tmp_list
 
 
+def get_stream_pages(zip_ref, image_prefix, image_extension):
+    images = {}
+    for info in zip_ref.infolist():
+        name = info.filename
+        if name.startswith(image_prefix) and '/' not in name[len(image_prefix):] and \
+                Path(name).suffix == image_extension:
+            images[name[len(image_prefix):]] = info
+    if not images:
+        return False
+
+    cover_arcname = f'cover{image_extension}'
+    parent_prefix = image_prefix.rstrip('/').rpartition('/')[0]
+    parent_cover = f"{parent_prefix}/{cover_arcname}" if parent_prefix else cover_arcname
+    if cover_arcname in images:
+        debug('Named cover found', 2)
+        cover_info = images.pop(cover_arcname)
+    elif image_prefix and parent_cover in zip_ref.NameToInfo:
+        debug('Found backup image file, using as cover', 2)
+        cover_info = zip_ref.getinfo(parent_cover)
+    elif f"page_cover{image_extension}" in images:
+        debug('Found page_cover, using as cover', 2)
+        cover_info = images[f"page_cover{image_extension}"]
+    else:
+        debug('Unable to find cover, setting first image as cover', 3)
+        cover_arcname = sorted(images)[0]
+        cover_info = images.pop(cover_arcname)
+
+    debug(f"Cover: \"{cover_info.filename}\"", 2)
+    page_names = sorted(images)
+    if not page_names:
+        return [(cover_info, cover_arcname)]
+
+    page_prefix = ''
+    if cover_arcname > page_names[0]:
+        debug('File names are non-ordered for cover, renaming pages in archive', 2)
+        page_prefix = 'page'
+
+    pages = [(images[name], f"{page_prefix}{name}") for name in page_names]
+    if members_match(zip_ref, cover_info, pages[0][0]):
+        debug(" Cover matches first file, removing cover", 2)
+        return pages
+    return [(cover_info, cover_arcname)] + pages
+
+
+def get_today_list(raw_calibre):
+    today = datetime.combine(date.today(), time.min).astimezone()
+    debug(f"Today's date: {today}", 2)
+    return get_since_list(raw_calibre, today, fields=('timestamp',))
+
+
+def get_touched(book_data):
+    return book_data['publisher'], get_manga_series(book_data), book_data['series_index']
+
+
+def get_watermark(raw_calibre):
+    stamps = [raw_calibre[item][field] for item in raw_calibre for field in ('timestamp', 'last_modified')
+              if raw_calibre[item].get(field)]
+    if not stamps:
+        return None
+    return max(stamps, key=parse_timestamp)
+
+
+def get_work_list(raw_calibre, report):
+    with open(report, newline='') as in_file:
+        rows = json.load(in_file) if Path(report).suffix == '.json' else list(csv.DictReader(in_file))
+
+    tmp_list = []
+    for row in rows:
+        if row.get('status') not in work_list_statuses or not row.get('book_id'):
+            continue
+        book_id = str(row['book_id'])
+        if book_id not in raw_calibre:
+            debug(f"Book {book_id} from {report} not in selected calibre data", 2)
+            continue
+        epubs = [book_format for book_format in raw_calibre[book_id]['formats'] if book_format.endswith('.epub')]
+        if epubs and os.path.isfile(epubs[0]):
+            tmp_list.append((epubs[0], book_id))
+        else:
+            debug(f"No epub on disk for book {book_id}", 1)
+
+    debug(f"Found {len(tmp_list)} mangas in {report}", 1)
+    return tmp_list
+
+
+def get_zip_date(book_data):
+    try:
+        return parse_timestamp(book_data['last_modified']).astimezone(timezone.utc).timetuple()[:6]
+    except (KeyError, TypeError, ValueError):
+        return 1980, 1, 1, 0, 0, 0
+
+
+def init_worker(settings, calibre_data):
+    global worker_calibre, page_transcoder, komga_client
+    worker_calibre = calibre_data
+    page_transcoder = None
+    komga_client = None
+    series_cache.clear()
+    folder_cache.clear()
+    globals().update(settings)
+    globals()['temp_folder'] = Path(settings['temp_folder']).joinpath(f"worker-{os.getpid()}").as_posix() + '/'
+    debug(f"Worker {os.getpid()} using temp folder: {temp_folder}", 2)
+
+
+@metrics.timed('komga_index')
+def load_komga_index(index_file, username, password, rebuild=False):
+    debug(f"Loading Komga index from: {index_file}", 2)
+    index = KomgaIndex.load(index_file, debug_hook=debug)
+    try:
+        index.refresh(get_komga_client(username, password), full=rebuild)
+    except KomgaError as e:
+        print(f'Error calling API: {e}')
+        exit(2)
+    index.save(index_file)
+    debug(f"Komga index holds {len(index.series)} series, {len(index.books)} books", 1)
+    return index
+
+
+def members_match(zip_ref, info_a, info_b):
+    if info_a.file_size != info_b.file_size or info_a.CRC != info_b.CRC:
+        debug(f" {info_a.filename} and {info_b.filename} differ by size/CRC", 3)
+        return False
+    debug(f" {info_a.filename} and {info_b.filename} share size/CRC, comparing digests", 3)
+    return get_member_hash(zip_ref, info_a) == get_member_hash(zip_ref, info_b)
+
+
+@contextmanager
+def open_cbz(cbz_location):
+    cbz_location = Path(cbz_location)
+    part_location = cbz_location.with_name(f".{cbz_location.name}.part")
+    debug(f" Writing to '{part_location}'", 3)
+    try:
+        with open(part_location, 'wb') as part_file:
+            with zipfile.ZipFile(part_file, 'w') as zip_ref:
+                yield zip_ref
+            part_file.flush()
+            os.fsync(part_file.fileno())
+        os.replace(part_location, cbz_location)
+        if folder_cache.get(cbz_location.parent.as_posix()) is not None:
+            folder_cache[cbz_location.parent.as_posix()].add(cbz_location.name)
+    except BaseException:
+        if os.path.isfile(part_location):
+            os.remove(part_location)
+        raise
+
+    try:
+        folder = os.open(cbz_location.parent, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(folder)
+    finally:
+        os.close(folder)
+
+
 def parse_args():
     parser = argparse.ArgumentParser(formatter_class=SortingHelpFormatter)
     parser.add_argument('-d', '--dry_run', action='store_true', required=False,
                         help='Dry run only, don\'t actually create anything')
     parser.add_argument('-l', '--debug_level', type=int, choices=[1, 2, 3], help='Set debug level (enabled debugging)')
     parser.add_argument('-t', '--temp_dir', required=False, help='Temporary folder to use when extracting manga')
+    parser.add_argument('-e', '--extract', required=False, action='store_true',
+                        help='Extract epubs to the temp folder instead of streaming images into the cbz')
+    parser.add_argument('-j', '--jobs', type=int, required=False, default=1,
+                        help='Number of volumes to convert in parallel')
+    parser.add_argument('--ignore_manifest', required=False, action='store_true',
+                        help="Don't use the conversion manifest to skip unchanged books")
     parser.add_argument('-k', '--skip_komga', required=False, action='store_true',
                         help="Don't check existing komga entry")
+    parser.add_argument('--komga_connections', type=int, required=False, default=komga_connections,
+                        help='Maximum concurrent requests to Komga')
+    parser.add_argument('--komga_timeout', type=float, required=False, default=komga_timeout,
+                        help='Komga request timeout in seconds')
+    parser.add_argument('--komga_index', required=False, default=komga_index_file,
+                        help='File to persist the Komga series/volume index in')
+    parser.add_argument('--komga_server', required=False, default=komga_server,
+                        help='Komga host name, or base URL (e.g. http://localhost:25600)')
+    parser.add_argument('--komga_token_file', required=False, default=komga_token_file,
+                        help="File to cache the Komga session token in between runs ('' to not cache it)")
+    parser.add_argument('--komga_wait', type=int, required=False, default=0,
+                        help='Seconds to wait for new volumes to show up in Komga after the rescan')
+    parser.add_argument('--skip_rescan', required=False, action='store_true',
+                        help="Don't ask Komga to rescan the libraries/series touched by this run")
+    parser.add_argument('--rebuild_index', required=False, action='store_true',
+                        help='Discard the saved Komga index and rebuild it from scratch')
+    parser.add_argument('--restart', required=False, action='store_true',
+                        help='Start over instead of resuming an interrupted run with the same selection')
+    parser.add_argument('--manifest', required=False, default=manifest_file,
+                        help='SQLite conversion manifest to record converted books in')
+    parser.add_argument('--metrics', required=False, help='Write per-stage timings and counters to this JSON file')
+    parser.add_argument('--metadata_backend', required=False, default=metadata_backend,
+                        choices=['calibredb', 'sqlite'],
+                        help='Read Calibre metadata via calibredb or directly from metadata.db')
     parser.add_argument('-p', '--password', required=False, default='cbz_converter', help='Komga Password')
+    parser.add_argument('--plan', required=False, choices=['csv', 'json'],
+                        help='Print what a run would do (from metadata, the Komga index and zip directories) '
+                             'instead of converting')
+    parser.add_argument('--plan_output', required=False, help='File to write the plan to (default: stdout)')
+    parser.add_argument('--reconcile_output', required=False,
+                        help='File to write the reconciliation report to (default: stdout)')
     parser.add_argument('--publisher', required=False, default='all', help='Publisher to convert')
     parser.add_argument('--purchase', required=False, default='all', help='Purchase location to convert')
+    parser.add_argument('--transcode', required=False, choices=sorted(FORMATS),
+                        help='Downscale and re-encode pages to this format (requires Pillow)')
+    parser.add_argument('--max_width', type=int, required=False, default=transcode_max_width,
+                        help='Maximum page width when transcoding')
+    parser.add_argument('--max_height', type=int, required=False, default=transcode_max_height,
+                        help='Maximum page height when transcoding')
+    parser.add_argument('--quality', type=int, required=False, default=transcode_quality,
+                        help='JPEG/WebP quality when transcoding')
+    parser.add_argument('--transcode_workers', type=int, required=False, default=transcode_workers,
+                        help='Processes per volume used for transcoding (default: one per CPU, inline with --jobs)')
+    parser.add_argument('--transcode_memory', type=int, required=False, default=transcode_memory,
+                        help='Maximum MB of source pages queued for transcoding per volume')
+    parser.add_argument('--thumbnails', required=False, action='store_true',
+                        help='Render cover thumbnails locally and upload them to Komga once it has indexed the books '
+                             '(requires Pillow)')
+    parser.add_argument('--thumbnail_size', type=int, required=False, default=300,
+                        help='Maximum thumbnail width/height in pixels (Komga default: 300)')
+    parser.add_argument('--thumbnail_batch', type=int, required=False, default=thumbnail_batch,
+                        help='Thumbnails uploaded per batch')
+    parser.add_argument('--thumbnail_rate', type=float, required=False, default=thumbnail_rate,
+                        help='Maximum thumbnail uploads per second')
+    parser.add_argument('--watch_debounce', type=float, required=False, default=watch_debounce,
+                        help='Seconds the library must be quiet before a burst of changes is converted')
+    parser.add_argument('--watch_interval', type=float, required=False, default=watch_interval,
+                        help='Seconds between checks for library changes in --watch mode')
     parser.add_argument('-u', '--user', required=False, default='cbz_converter', help='Komga Username')
     group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--reconcile', required=False, choices=['csv', 'json'],
+                       help='Report Calibre volumes missing from Komga, Komga books without a Calibre source and '
+                            'duplicates on either side')
+    group.add_argument('--work_list', required=False,
+                       help='Convert the missing books of a --reconcile report (or the planned books of a --plan '
+                            'file)')
+    group.add_argument('--refresh_metadata', required=False, action='store_true',
+                       help='Rewrite only the ComicInfo.xml of existing cbz files whose Calibre metadata changed')
+    group.add_argument('--manifest_rebuild', required=False, action='store_true',
+                       help='Rebuild the conversion manifest from existing cbz files')
+    group.add_argument('--manifest_show', required=False, action='store_true',
+                       help='Show the contents of the conversion manifest')
     group.add_argument('-m', '--manga', required=False, help='Single manga to convert')
     group.add_argument('-r', '--root_folder', required=False, help='Root folder of manga to convert')
+    group.add_argument('--since', required=False,
+                       help='Only convert manga added or modified since this ISO date/time (local if no offset)')
+    group.add_argument('--since_last_run', required=False, action='store_true',
+                       help='Only convert manga added or modified since the last --since_last_run')
+    group.add_argument('--watch', required=False, action='store_true',
+                       help='Keep running and convert books as they are added to or changed in Calibre')
     group.add_argument('--today', required=False, action='store_true', help='Only convert manga added today')
     return parser.parse_args()
 
 
+def parse_timestamp(value):
+    stamp = datetime.fromisoformat(value)
+    if stamp.tzinfo is None:
+        stamp = stamp.astimezone()
+    return stamp
+
+
+def plan_all(files, calibre_data, user, password, plan_format, output, jobs=1, manifest=None):
+    rows = [plan_manga(Path(file).as_posix(), calibre_data, user, password, manifest, book_id)
+            for file, book_id in files]
+
+    pending = [row for row in rows if row['status'] == 'convert']
+    debug(f"Reading {len(pending)} archive directories with {jobs} threads", 2)
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        for row, (status, pages, page_bytes) in zip(pending, pool.map(plan_archive, [r['epub'] for r in pending])):
+            row['status'] = status
+            row['pages'] = pages
+            row['estimated_bytes'] = row['estimated_bytes'] + page_bytes if status == 'convert' else 0
+
+    write_report(rows, plan_fields, plan_format, output)
+
+    counts = {}
+    for row in rows:
+        counts[row['status']] = counts.get(row['status'], 0) + 1
+    total_bytes = sum(row['estimated_bytes'] for row in rows)
+    summary = ', '.join(f"{status}: {count}" for status, count in sorted(counts.items()))
+    print(f"Planned {len(rows)} volumes ({summary}), {total_bytes} bytes to write", file=sys.stderr)
+    return rows
+
+
+def plan_archive(epub):
+    try:
+        with zipfile.ZipFile(epub, 'r') as zip_ref:
+            status, pages = get_archive_pages(zip_ref)
+    except (OSError, zipfile.BadZipFile) as e:
+        debug(f"Unable to read {epub}: {e}")
+        return 'failed', 0, 0
+    if status != 'ok':
+        debug(f"{epub}: {pages}", 2)
+        return status, 0, 0
+    return 'convert', len(pages), sum(info.file_size for info, _ in pages)
+
+
+def plan_manga(epub, calibre_data, user=False, password=False, manifest=None, book_id=None):
+    book_id = book_id or get_book_id(epub)
+    book_data = calibre_data[book_id]
+    manga_series = get_manga_series(book_data)
+    row = {'book_id': book_id, 'epub': epub, 'series': manga_series, 'volume': book_data['series_index'],
+           'status': 'missing', 'pages': 0, 'estimated_bytes': 0,
+           'cbz': get_cbz_path(book_data, manga_series).as_posix()}
+    if not os.path.isfile(epub):
+        return row
+
+    if manifest is not None:
+        stat = os.stat(epub)
+        if manifest.is_unchanged(book_id, stat.st_size, stat.st_mtime_ns):
+            row['status'] = 'unchanged'
+            return row
+
+    try:
+        in_komga = not skip_komga and check_komga(manga_series, book_data['series_index'], user, password)
+    except KomgaError as e:
+        print(f'Error calling API: {e}', file=sys.stderr)
+        row['status'] = 'failed'
+        return row
+    if in_komga:
+        row['status'] = 'komga'
+        return row
+
+    if not skip_local and not check_path(book_data['publisher'], manga_series, book_data['series_index'], False):
+        row['status'] = 'local'
+        return row
+
+    row['status'] = 'convert'
+    row['estimated_bytes'] = len(build_comix(book_data).encode())
+    return row
+
+
+def print_series_report(series_times):
+    rows = sorted(series_times.items(), key=lambda item: -item[1][1])
+    shown = rows if DEBUG and debug_level >= 2 else rows[:10]
+    print(f"{'series':<40} {'volumes':>7} {'total s':>9} {'avg ms':>9}")
+    for series, (volumes, seconds) in shown:
+        print(f"{series[:40]:<40} {volumes:>7} {seconds:>9.3f} {seconds / volumes * 1000:>9.1f}")
+    if len(rows) > len(shown):
+        print(f"... and {len(rows) - len(shown)} more series")
+
+
+def read_calibre(limited=False, publisher='all', purchase='all', since=None, title=None):
+    metadata = get_calibre_metadata()
+    tmp_calibre_data = metadata.read(publisher=publisher if publisher != 'all' else None,
+                                     purchase=purchase if purchase != 'all' else None,
+                                     ids=[limited] if limited else None,
+                                     modified_since=since,
+                                     title=title,
+                                     fields=calibre_fields)
+
+    tmp_calibre_data = convert_calibre_data(tmp_calibre_data, loader=metadata.read_lazy)
+    return tmp_calibre_data
+
+
+def rebuild_manifest(manifest, calibre_data):
+    debug('Rebuilding manifest from existing cbz files', 1)
+    manifest.clear()
+    for book_id, book_data in calibre_data.items():
+        epubs = [book_format for book_format in book_data.get('formats', []) if book_format.endswith('.epub')]
+        if not epubs:
+            continue
+        cbz_path = get_cbz_path(book_data, get_manga_series(book_data))
+        if not os.path.isfile(cbz_path):
+            debug(f"No cbz for {book_id} at {cbz_path}", 3)
+            continue
+        if not os.path.isfile(epubs[0]):
+            debug(f"Source epub missing for {book_id}: {epubs[0]}", 2)
+            continue
+        entry = get_manifest_entry(epubs[0], calibre_data, book_id)
+        entry['converted_at'] = datetime.fromtimestamp(os.stat(cbz_path).st_mtime, timezone.utc) \
+            .isoformat(timespec='seconds')
+        manifest.record(**entry)
+    print(f"Rebuilt manifest with {len(manifest)} books")
+
+
+@metrics.timed('reconcile')
+def reconcile(calibre_data, publisher, purchase, report_format, output):
+    calibre_volumes = {}
+    for book_id, book_data in calibre_data.items():
+        manga_series = get_manga_series(book_data)
+        series_key = series_replacements.get(manga_series) or komga_index.find_series(manga_series) or \
+            normalize_name(manga_series)
+        number = str(get_book_number(book_data))
+        for number in expand_number(number) if '-' in number else {normalize_number(book_data['series_index'])}:
+            calibre_volumes.setdefault((series_key, number), []).append(book_id)
+
+    selected_series = None
+    if publisher != 'all' or purchase != 'all':
+        selected_series = {series_key for series_key, _ in calibre_volumes}
+    komga_volumes = {}
+    for series_id in komga_index.series:
+        if selected_series is not None and series_id not in selected_series:
+            continue
+        for number, book_ids in komga_index.volumes(series_id).items():
+            komga_volumes[(series_id, number)] = sorted(book_ids)
+
+    missing = calibre_volumes.keys() - komga_volumes.keys()
+    extra = komga_volumes.keys() - calibre_volumes.keys()
+    rows = [get_calibre_row('missing', book_id, calibre_data[book_id])
+            for book_id in sorted({book_id for key in missing for book_id in calibre_volumes[key]}, key=int)]
+    rows += [get_komga_row('extra', *key, komga_id) for key in sorted(extra) for komga_id in komga_volumes[key]]
+    rows += [get_calibre_row('duplicate', book_id, calibre_data[book_id])
+             for key, book_ids in sorted(calibre_volumes.items()) if len(book_ids) > 1 for book_id in book_ids]
+    rows += [get_komga_row('duplicate', *key, komga_id)
+             for key, komga_ids in sorted(komga_volumes.items()) if len(komga_ids) > 1 for komga_id in komga_ids]
+
+    write_report(rows, reconcile_fields, report_format, output)
+    counts = {}
+    for row in rows:
+        counts[row['status']] = counts.get(row['status'], 0) + 1
+    summary = ', '.join(f"{status}: {count}" for status, count in sorted(counts.items())) or 'in sync'
+    print(f"Reconciled {len(calibre_volumes)} Calibre and {len(komga_volumes)} Komga volumes ({summary})",
+          file=sys.stderr)
+    return rows
+
+
+def refresh_all(calibre_data, manifest, dry_run_inner, touched=None):
+    counts = {}
+    for book_id, book_data in sorted(calibre_data.items(), key=lambda item: int(item[0])):
+        row = manifest.get(book_id) if manifest is not None else None
+        try:
+            status = refresh_comix(book_id, book_data, row, manifest, dry_run_inner)
+        except (OSError, zipfile.BadZipFile) as e:
+            print(f" Error refreshing {book_data['title']}: {e}")
+            status = 'failed'
+        counts[status] = counts.get(status, 0) + 1
+        if touched is not None and status == 'refreshed':
+            touched.add(get_touched(book_data))
+
+    summary = ', '.join(f"{status}: {count}" for status, count in sorted(counts.items()))
+    print(f"Checked {len(calibre_data)} volumes for metadata changes ({summary})")
+    return counts
+
+
+def refresh_comix(book_id, book_data, row, manifest=None, dry_run_inner=False):
+    manga_series = get_manga_series(book_data)
+    cbz_location = get_cbz_path(book_data, manga_series)
+    source = Path(row['cbz_path']) if row is not None else cbz_location
+    if not os.path.isfile(source):
+        debug(f" No cbz for {book_id} at {source}", 3)
+        return 'missing'
+
+    inputs = get_comix_inputs(book_data)
+    xml = build_comix(book_data)
+    if row is not None and row['comicinfo_inputs'] is not None:
+        if json.loads(row['comicinfo_inputs']) == json.loads(json.dumps(inputs)) and source == cbz_location:
+            return 'current'
+    else:
+        with zipfile.ZipFile(source, 'r') as zip_ref:
+            if info_name in zip_ref.NameToInfo and zip_ref.read(info_name).decode() == xml:
+                return 'current'
+
+    if source != cbz_location and os.path.exists(cbz_location):
+        print(f" Not moving {source} to {cbz_location}, a file already exists there")
+        return 'failed'
+
+    print(f"Refreshing ComicInfo.xml of {manga_series}, Vol. {int(book_data['series_index'])}")
+    if dry_run_inner:
+        return 'refreshed'
+
+    check_path(book_data['publisher'], manga_series, book_data['series_index'], True)
+    with metrics.timer('comicinfo_refresh', items=1, bytes=os.path.getsize(source)):
+        with zipfile.ZipFile(source, 'r') as zip_in, open_cbz(cbz_location) as zip_out:
+            for info in zip_in.infolist():
+                if info.filename != info_name:
+                    copy_raw_member(zip_in, info, zip_out)
+            zip_out.writestr(zipfile.ZipInfo(info_name, date_time=get_zip_date(book_data)), xml)
+    if source != cbz_location:
+        debug(f" Moved {source} to {cbz_location}", 2)
+        os.remove(source)
+
+    if manifest is not None and row is not None:
+        manifest.record(book_id, row['epub_path'], row['epub_size'], row['epub_mtime_ns'], cbz_location.as_posix(),
+                        get_hash(cbz_location), inputs)
+    return 'refreshed'
+
+
 def reorder(directory, cover_image):
     debug('Beginning image shuffle', 3)
 
@@ -627,8 +1704,270 @@ def reorder(directory, cover_image):
     return new_first_file
 
 
+@metrics.timed('komga_rescan')
+def rescan_komga(touched, username, password, wait=0):
+    client = get_komga_client(username, password)
+    try:
+        libraries = client.libraries()
+    except KomgaError as e:
+        print(f'Error calling API: {e}')
+        return False
+
+    scan_libraries = set()
+    analyze_series = set()
+    try:
+        for publisher, series, volume in sorted(touched, key=str):
+            series_id = series_replacements.get(series) or \
+                (komga_index.find_series(series) if komga_index is not None else
+                 find_series(series, username, password))
+            if series_id and check_komga(series, volume, username, password):
+                debug(f" {series} Vol. {volume} already in Komga, analyzing series {series_id}", 3)
+                analyze_series.add(series_id)
+                continue
+            library_id = get_series_library(client, series_id) or get_komga_library(libraries, publisher)
+            if not library_id:
+                print(f" No Komga library found for '{publisher}', not rescanning {series}")
+                continue
+            debug(f" {series} Vol. {volume} is new, scanning library {library_id}", 3)
+            scan_libraries.add(library_id)
+
+        analyze_series = {series_id for series_id in analyze_series
+                          if get_series_library(client, series_id) not in scan_libraries}
+        print(f"Komga rescan: {len(scan_libraries)} libraries, {len(analyze_series)} series")
+        for library_id in sorted(scan_libraries):
+            client.scan_library(library_id)
+        for series_id in sorted(analyze_series):
+            client.analyze_series(series_id)
+    except KomgaError as e:
+        print(f'Error calling API: {e}')
+        return False
+
+    if wait:
+        return wait_for_komga(touched, client, wait)
+    return True
+
+
+def resolve_href(base_name, href):
+    href = unquote(href.split('#')[0])
+    return posixpath.normpath(posixpath.join(posixpath.dirname(base_name), href))
+
+
+def show_manifest(manifest):
+    print('book_id\tconverted_at\tepub_size\tcbz_path')
+    for row in manifest.rows():
+        print(f"{row['book_id']}\t{row['converted_at']}\t{row['epub_size']}\t{row['cbz_path']}")
+    print(f"Manifest holds {len(manifest)} books")
+
+
+def stream_cbz(zip_ref, book_data, manga_series, pages, xml):
+    cbz_location = get_cbz_path(book_data, manga_series)
+    debug(f" CBZ file: '{cbz_location}", 2)
+    with open_cbz(cbz_location) as cbz_ref:
+        if transcode_format:
+            transcode_pages(cbz_ref, [(arcname, info.date_time, info.file_size, partial(zip_ref.read, info))
+                                      for info, arcname in pages])
+        else:
+            for info, arcname in pages:
+                copy_raw_member(zip_ref, info, cbz_ref, arcname)
+        cbz_ref.writestr(zipfile.ZipInfo(info_name, date_time=get_zip_date(book_data)), xml)
+
+
+def stream_manga(epub, book_data, manga_series, dry_run_inner=False):
+    debug("Starting streamed manga conversion")
+    with zipfile.ZipFile(epub, 'r') as zip_ref:
+        with metrics.timer('pages', items=1):
+            status, pages = get_archive_pages(zip_ref)
+        if status != 'ok':
+            print(pages)
+            debug(f" {pages}")
+            return status
+
+        debug('Building Comic Info')
+        with metrics.timer('comicinfo', items=1):
+            xml = build_comix(book_data)
+
+        debug("Generating new cbz volume")
+        if not dry_run_inner:
+            with metrics.timer('cbz_write', items=1) as timer:
+                stream_cbz(zip_ref, book_data, manga_series, pages, xml)
+                timer.add(bytes=os.path.getsize(get_cbz_path(book_data, manga_series)))
+            if thumbnail_size:
+                add_thumbnail(book_data, zip_ref.read(pages[0][0]))
+
+    print(' Build complete')
+    return 'converted'
+
+
+def transcode_pages(zip_out, pages):
+    transcoder = get_page_transcoder()
+    dates = {arcname: date_time for arcname, date_time, _, _ in pages}
+    before = after = 0
+    with metrics.timer('transcode', items=len(pages)) as timer:
+        for arcname, data, size, transcoded in transcoder.transcode((arcname, size, loader)
+                                                                    for arcname, _, size, loader in pages):
+            out_name = posixpath.splitext(arcname)[0] + transcoder.suffix if transcoded else arcname
+            debug(f" {arcname} -> {out_name}: {size} -> {len(data)} bytes", 3)
+            zip_out.writestr(zipfile.ZipInfo(out_name, date_time=dates[arcname]), data)
+            before += size
+            after += len(data)
+        timer.add(bytes=before)
+    print(f" Transcoded {len(pages)} pages: {before} -> {after} bytes (saved {before - after})")
+    return before - after
+
+
+def upload_thumbnail(client, book_id, data):
+    try:
+        client.upload_book_thumbnail(book_id, data)
+    except KomgaError as e:
+        print(f'Error uploading thumbnail: {e}')
+        return False
+    return True
+
+
+def upload_thumbnails(manifest, username, password):
+    global thumbnails
+    if manifest is not None:
+        for (publisher, series, volume), data in thumbnails.items():
+            manifest.add_thumbnail(publisher, series, volume, data)
+        pending = {(row['publisher'], row['series'], row['volume']): row['data'] for row in manifest.thumbnails()}
+    else:
+        pending = dict(thumbnails)
+    thumbnails = {}
+    if not pending:
+        return
+
+    uploads = []
+    waiting = 0
+    for key in sorted(pending, key=str):
+        publisher, series, volume = key
+        series_id = series_replacements.get(series) or komga_index.find_series(series)
+        book_ids = komga_index.find_books(series_id, volume) if series_id else set()
+        if book_ids:
+            uploads.append((key, sorted(book_ids)[0]))
+            continue
+        debug(f" {series} Vol. {volume} not indexed by Komga yet, keeping thumbnail", 3)
+        waiting += 1
+        if manifest is None:
+            thumbnails[key] = pending[key]
+    print(f"Uploading {len(uploads)} thumbnails to Komga ({waiting} waiting to be indexed)")
+
+    client = get_komga_client(username, password)
+    with metrics.timer('thumbnail_upload') as timer:
+        for start in range(0, len(uploads), thumbnail_batch):
+            batch = uploads[start:start + thumbnail_batch]
+            began = monotonic()
+            with ThreadPoolExecutor(max_workers=komga_connections) as pool:
+                results = list(pool.map(partial(upload_thumbnail, client), [book_id for _, book_id in batch],
+                                        [pending[key] for key, _ in batch]))
+            for (key, _), uploaded in zip(batch, results):
+                if not uploaded:
+                    if manifest is None:
+                        thumbnails[key] = pending[key]
+                    continue
+                timer.add(items=1, bytes=len(pending[key]))
+                if manifest is not None:
+                    manifest.remove_thumbnail(*key)
+            if start + thumbnail_batch < len(uploads):
+                sleep(max(0.0, len(batch) / thumbnail_rate - (monotonic() - began)))
+
+
+def wait_for_komga(touched, client, timeout):
+    deadline = monotonic() + timeout
+    while True:
+        series_cache.clear()
+        try:
+            if komga_index is not None:
+                komga_index.refresh(client)
+            missing = [(series, volume) for _, series, volume in touched
+                       if not check_komga(series, volume, False, False)]
+        except KomgaError as e:
+            print(f'Error calling API: {e}')
+            return False
+        if not missing:
+            print(f"All {len(touched)} converted volumes are in Komga")
+            return True
+        if monotonic() >= deadline:
+            print(f"Timed out waiting for Komga, {len(missing)} volumes still missing")
+            debug(f" Missing: {missing}", 2)
+            return False
+        debug(f"Waiting for {len(missing)} volumes to appear in Komga", 2)
+        sleep(max(0.0, min(komga_poll_interval, deadline - monotonic())))
+
+
+def watch_library(calibre_data, since, publisher, purchase, user, password, dry_run_inner, jobs=1, manifest=None,
+                  watermark_name=None, index_file=komga_index_file, rescan=True):
+    global komga_index
+    if (rescan or thumbnail_size) and komga_index is None:
+        komga_index = load_komga_index(index_file, user, password)
+
+    watcher = LibraryWatcher(library_path, watch_interval, watch_debounce, debug_hook=debug)
+    mark = since
+    try:
+        while True:
+            files = get_since_list(calibre_data, mark)
+            missing = [file for file, _ in files if not os.path.isfile(file)]
+            if missing:
+                print(f"{len(missing)} books not on disk yet, will retry on the next change")
+                debug(f"Missing: {missing}", 2)
+            files = sorted(entry for entry in files if entry[0] not in missing)
+            failed = False
+            if files:
+                touched = set()
+                try:
+                    counts = convert_all(files, calibre_data, publisher, purchase, user, password, dry_run_inner,
+                                         jobs, manifest, touched)
+                    failed = any(counts.get(status) for status in retry_statuses)
+                    if failed:
+                        print('Some books were not converted, will retry them on the next change')
+                except Exception as e:
+                    print(f"Error converting changed books, will retry on the next change: {e}")
+                    failed = True
+                if touched and rescan and not dry_run_inner:
+                    rescan_komga(touched, user, password)
+            if thumbnail_size and not dry_run_inner:
+                upload_thumbnails(manifest, user, password)
+
+            watermark = get_watermark(calibre_data)
+            if watermark and not missing and not failed:
+                mark = parse_timestamp(watermark)
+                if manifest is not None and not dry_run_inner:
+                    manifest.set_watermark(watermark_name, watermark)
+
+            print(f"Watching {library_path} for new books (changed since {mark})")
+            watcher.wait()
+            debug('Library changed, reading new and changed books', 1)
+            calibre_data = dump_calibre(publisher=publisher, purchase=purchase, since=mark)
+            if komga_index is not None:
+                try:
+                    komga_index.refresh(get_komga_client(user, password))
+                    komga_index.save(index_file)
+                except KomgaError as e:
+                    print(f'Error calling API: {e}')
+    except KeyboardInterrupt:
+        print('Stopping watch mode')
+    finally:
+        watcher.stop()
+
+
+def write_report(rows, fields, report_format, output):
+    out = open(output, 'w', newline='') if output else sys.stdout
+    try:
+        if report_format == 'csv':
+            writer = csv.DictWriter(out, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(rows)
+        else:
+            json.dump(rows, out, indent=1)
+            out.write('\n')
+    finally:
+        if output:
+            out.close()
+
+
 if __name__ == '__main__':
+    sentry_init(debug_hook=debug)
     args = parse_args()
+    metrics.begin()
 
     if args.debug_level:
         DEBUG = True
@@ -645,24 +1984,152 @@ if __name__ == '__main__':
         skip_komga = args.skip_komga
         debug(f"Set skip komga to: {skip_komga}")
 
-    debug('Dumping Calibre data')
-    calibre = dump_calibre()
+    if args.extract:
+        extract_images = args.extract
+        debug(f"Set extract mode to: {extract_images}")
+
+    if args.temp_dir:
+        temp_folder = args.temp_dir
+        debug(f"Set temp folder to: {temp_folder}")
+
+    if args.transcode:
+        transcode_format = args.transcode
+        transcode_max_width = args.max_width
+        transcode_max_height = args.max_height
+        transcode_quality = args.quality
+        transcode_workers = args.transcode_workers or (0 if args.jobs <= 1 else 1)
+        transcode_memory = args.transcode_memory
+        debug(f"Set transcode to: {transcode_format}, {transcode_workers} workers", 1)
+
+    if args.thumbnails:
+        thumbnail_size = args.thumbnail_size
+        thumbnail_batch = args.thumbnail_batch
+        thumbnail_rate = args.thumbnail_rate
+        debug(f"Set thumbnails to: {thumbnail_size}px, {thumbnail_batch} per batch, {thumbnail_rate}/s", 1)
+
+    watch_interval = args.watch_interval
+    watch_debounce = args.watch_debounce
+
+    komga_server = args.komga_server
+    komga_timeout = args.komga_timeout
+    komga_connections = args.komga_connections
+    komga_token_file = args.komga_token_file
+
+    manifest = None
+    if not args.ignore_manifest or args.manifest_show or args.manifest_rebuild or args.since_last_run:
+        debug(f"Opening manifest: {args.manifest}", 2)
+        manifest = ConversionManifest(args.manifest, debug_hook=debug)
+
+    if args.manifest_show:
+        show_manifest(manifest)
+        sys.exit(0)
+
+    metadata_backend = args.metadata_backend
+
+    since = None
+    watermark_name = f"calibre:{args.publisher}:{args.purchase}"
+    if args.today:
+        since = datetime.combine(date.today(), time.min).astimezone()
+    elif args.since:
+        since = parse_timestamp(args.since)
+    elif args.since_last_run or args.watch:
+        last_run = manifest.get_watermark(watermark_name) if manifest is not None else None
+        debug(f"Last run watermark: {last_run}", 1)
+        if last_run:
+            since = parse_timestamp(last_run)
+        else:
+            since = datetime.now(timezone.utc) if args.watch else datetime.fromtimestamp(0, timezone.utc)
 
-    if args.root_folder:
+    limited, title = get_manga_query(args.manga) if args.manga else (False, None)
+    debug('Dumping Calibre data')
+    calibre = dump_calibre(limited=limited,
+                           publisher='all' if args.manifest_rebuild else args.publisher,
+                           purchase='all' if args.manifest_rebuild else args.purchase,
+                           since=since, title=title)
+
+    if args.manifest_rebuild:
+        rebuild_manifest(manifest, calibre)
+        sys.exit(0)
+
+    if not skip_komga and not args.manga:
+        debug('Loading Komga index')
+        komga_index = load_komga_index(args.komga_index, args.user, args.password, args.rebuild_index)
+
+    if args.manga:
+        debug(f"Running single manga conversion: {args.manga}", 2)
+        files = get_manga_list(calibre, args.manga)
+    elif args.root_folder is not None:
         debug('Running multiple folder conversion', 2)
-        if library_path not in args.root_folder:
-            folder_path = Path(library_path).joinpath(args.root_folder)
-        else:
-            folder_path = library_path
+        folder_path = Path(library_path).joinpath(args.root_folder)
         debug(f"Looking in folder: {folder_path}", 3)
-        files = list(Path(folder_path).rglob("*.epub"))
-        debug(f"Found files: {files}", 3)
-        for file in sorted(files):
-            convert_manga(Path(file).as_posix(), calibre, args.publisher, args.purchase, args.user, args.password,
-                          dry_run)
+        files = get_folder_list(calibre, folder_path)
+    elif args.work_list:
+        debug(f"Running conversion of books listed in {args.work_list}", 2)
+        files = get_work_list(calibre, args.work_list)
     elif args.today:
         debug('Running today conversion', 2)
         files = get_today_list(calibre)
-        for file in sorted(files):
-            convert_manga(Path(file).as_posix(), calibre, args.publisher, args.purchase, args.user, args.password,
-                          dry_run)
+    elif args.since or args.since_last_run:
+        debug(f"Running conversion of books changed since {since}", 2)
+        files = get_since_list(calibre, since)
+
+    if args.watch:
+        debug(f"Watching for books changed since {since}", 1)
+        watch_library(calibre, since, args.publisher, args.purchase, args.user, args.password, dry_run, args.jobs,
+                      manifest, watermark_name, args.komga_index, not args.skip_rescan)
+        print(metrics.summary())
+    elif args.reconcile:
+        if komga_index is None:
+            komga_index = load_komga_index(args.komga_index, args.user, args.password, args.rebuild_index)
+        reconcile(calibre, args.publisher, args.purchase, args.reconcile, args.reconcile_output)
+    elif args.refresh_metadata:
+        touched = set()
+        refresh_all(calibre, manifest, dry_run, touched)
+        if touched and not dry_run and not args.skip_rescan:
+            if komga_index is None:
+                komga_index = load_komga_index(args.komga_index, args.user, args.password, args.rebuild_index)
+            rescan_komga(touched, args.user, args.password, args.komga_wait)
+            komga_index.save(args.komga_index)
+        print(metrics.summary())
+    elif args.plan:
+        plan_all(sorted(files), calibre, args.user, args.password, args.plan, args.plan_output, args.jobs, manifest)
+    else:
+        touched = set()
+        journal = get_journal_name(args, since)
+        if args.restart and manifest is not None and journal:
+            manifest.journal_clear(journal)
+        counts = convert_all(sorted(files), calibre, args.publisher, args.purchase, args.user, args.password,
+                             dry_run, args.jobs, manifest, touched, journal)
+        watermark = get_watermark(calibre)
+        if args.since_last_run and watermark and not dry_run:
+            if any(counts.get(status) for status in retry_statuses):
+                print('Some books were not converted, keeping the last run mark so they are retried next time')
+            else:
+                manifest.set_watermark(watermark_name, watermark)
+
+        if touched and not dry_run and not args.skip_rescan:
+            if komga_index is None and not args.manga:
+                komga_index = load_komga_index(args.komga_index, args.user, args.password, args.rebuild_index)
+            rescan_komga(touched, args.user, args.password, args.komga_wait)
+            if komga_index is not None:
+                komga_index.save(args.komga_index)
+
+        if thumbnail_size and not dry_run:
+            if komga_index is None:
+                komga_index = load_komga_index(args.komga_index, args.user, args.password, args.rebuild_index)
+            elif not args.komga_wait:
+                try:
+                    komga_index.refresh(get_komga_client(args.user, args.password))
+                except KomgaError as e:
+                    print(f'Error calling API: {e}')
+            upload_thumbnails(manifest, args.user, args.password)
+            komga_index.save(args.komga_index)
+
+        print(metrics.summary())
+
+    if page_transcoder is not None:
+        page_transcoder.close()
+
+    metrics.end()
+    if args.metrics:
+        metrics.write_json(args.metrics)
@@ -10,9 +10,11 @@ from typing import Tuple
 
 from shared_libs.argparse_utils import SortingHelpFormatter
 from shared_libs.debug_utils import Debugger
+from shared_libs.instrumentation import Metrics
 from shared_libs.sentry_bootstrap import init as sentry_init
 
 debugger = Debugger()
+metrics = Metrics("copy_books", debug_hook=debugger.log)
 
 
 def check_encryption(book: Path) -> Tuple[str, str]:
@@ -59,7 +61,10 @@ def download_files(tmp_directory: Path) -> None:
         debugger.log(f"Will run command: {' '.join(run_command)}", 2)
         print("Pulling books from tablet")
 
-        result = subprocess.run(run_command, capture_output=True, text=True, check=True)
+        with metrics.timer("adb_pull") as timer:
+            result = subprocess.run(run_command, capture_output=True, text=True, check=True)
+            pulled = [path for path in tmp_directory.rglob("*") if path.is_file()]
+            timer.add(items=len(pulled), bytes=sum(path.stat().st_size for path in pulled))
         debugger.log(f"adb output: {result.stdout}", 3)
     except subprocess.CalledProcessError as e:
         print(f"adb command failed with error: {e}")
@@ -90,7 +95,8 @@ def process_books(in_dir: Path, out_dir: Path) -> None:
                     target = out_dir.joinpath(filename)
                     if not target.is_file():
                         print(f"{name}")
-                        shutil.copy(full_path, out_dir)
+                        with metrics.timer("copy", items=1, bytes=full_path.stat().st_size, description=filename):
+                            shutil.copy(full_path, out_dir)
                     else:
                         debugger.log(f"File {filename} already exists, skipping", 2)
 
@@ -113,6 +119,10 @@ def parse_args():
         default=f"{Path(tempfile.gettempdir()) / 'tmp_books'}",
         help="Temporary folder to use when copying books"
     )
+    parser.add_argument(
+        "--metrics", required=False,
+        help="Write per-stage timings and counters to this JSON file"
+    )
     parser.add_argument(
         "-o", "--output_dir", required=False,
         default=f"{Path('~').expanduser()}",
@@ -135,8 +145,13 @@ if __name__ == "__main__":
         out_dir = Path(args.output_dir).expanduser()
 
         debugger.log(f"Using tmp dir: {tmp_dir}")
-        download_files(tmp_dir)
-        process_books(tmp_dir, out_dir)
+        with metrics.transaction():
+            download_files(tmp_dir)
+            process_books(tmp_dir, out_dir)
+
+        print(metrics.summary())
+        if args.metrics:
+            metrics.write_json(args.metrics)
 
     except Exception as e:
         debugger.log(f"Unhandled exception: {e}", 1)
@@ -3,12 +3,18 @@
 import argparse
 import os.path
 
+from concurrent.futures import ThreadPoolExecutor
 from operator import attrgetter
 from pathlib import Path
-from subprocess import Popen, PIPE, STDOUT
+from subprocess import DEVNULL, PIPE, run
 from sys import stdout
 
+from shared_libs.instrumentation import Metrics
+from shared_libs.sentry_bootstrap import init as sentry_init
+
 DEBUG = False
+debug_level = 1
+dry_run = False
 
 
 class SortingHelpFormatter(argparse.HelpFormatter):
@@ -17,6 +23,21 @@ class SortingHelpFormatter(argparse.HelpFormatter):
         super(SortingHelpFormatter, self).add_arguments(actions)
 
 
+metrics = Metrics('flac_convert', debug_hook=lambda msg, level: debug(msg, level))
+
+
+def convert_all(file_list, jobs):
+    counts = {}
+    debug(f"Converting {len(file_list)} files with {jobs} jobs", 1)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for number, (flac_file, status, message) in enumerate(executor.map(run_convert, file_list), start=1):
+            counts[status] = counts.get(status, 0) + 1
+            print(f"[{number}/{len(file_list)}] {status}: {flac_file}{f' ({message})' if message else ''}")
+
+    print(', '.join(f"{status}: {counts.get(status, 0)}" for status in ['converted', 'skipped', 'failed']))
+    return counts
+
+
 def debug(msg='', debug_msg_level=1, out=stdout):
     if DEBUG and debug_msg_level <= debug_level:
         if msg != '':
@@ -32,38 +53,42 @@ def parse_args():
 
     parser.add_argument('-r', '--root', required=True, help='Folder with files to convert, or file to convert')
     parser.add_argument('--dry-run', action='store_true', help='Only show what would be done')
+    parser.add_argument('-j', '--jobs', type=int, required=False, default=os.cpu_count() or 1,
+                        help='Number of files to convert in parallel (default: CPU count)')
     parser.add_argument('-l', '--debug_level', type=int, choices=[1, 2, 3], help='Set debug level (enabled debugging)')
+    parser.add_argument('--metrics', required=False, help='Write per-stage timings and counters to this JSON file')
 
     return parser.parse_args()
 
 
 def run_convert(flac_file):
-    print(f"Starting processing on: {flac_file}")
-    base_name = Path(flac_file).stem
-    raw_path = Path(flac_file).parent
-    debug(f"Looking at file: {raw_path}/{base_name}")
-    if os.path.exists(Path(raw_path).joinpath(f"{base_name}.m4a")):
-        print('m4a already exists')
-        return True
-
-    break_command = f'ffmpeg -loglevel panic -i "{Path(flac_file)}" ' \
-                    f'-vn -c copy -acodec alac "{Path(raw_path).joinpath(f"{base_name}.m4a")}"'
-    debug(f"Command: {break_command}", 3)
-    q = Popen(break_command, shell=True, stdin=PIPE, stdout=PIPE, stderr=STDOUT)
-    _, _ = q.communicate()
-    q.wait()
-
-    if q.returncode != 0:
-        print('Error converting')
-        return False
-    else:
-        os.remove(Path(flac_file))
+    m4a_file = Path(flac_file).with_suffix('.m4a')
+    debug(f"Looking at file: {flac_file}")
+    if os.path.exists(m4a_file):
+        return flac_file, 'skipped', 'm4a already exists'
+
+    command = ['ffmpeg', '-nostdin', '-loglevel', 'error', '-i', str(flac_file),
+               '-vn', '-c', 'copy', '-acodec', 'alac', str(m4a_file)]
+    debug(f"Command: {command}", 3)
+    if dry_run:
+        return flac_file, 'skipped', 'dry run'
+
+    with metrics.timer('ffmpeg', items=1, bytes=os.path.getsize(flac_file), description=str(flac_file)):
+        result = run(command, stdin=DEVNULL, stdout=DEVNULL, stderr=PIPE, text=True)
 
-    return True
+    if result.returncode != 0:
+        m4a_file.unlink(missing_ok=True)
+        error = result.stderr.strip().splitlines()
+        return flac_file, 'failed', error[-1] if error else f"ffmpeg exited with {result.returncode}"
+
+    os.remove(Path(flac_file))
+    return flac_file, 'converted', None
 
 
 if __name__ == '__main__':
+    sentry_init(debug_hook=debug)
     args = parse_args()
+    metrics.begin()
 
     if args.debug_level:
         DEBUG = True
@@ -77,13 +102,17 @@ if __name__ == '__main__':
     if '.flac' in args.root:
         debug('Running in single file mode')
         if os.path.isfile(Path(args.root)):
-            run_convert(args.root)
+            convert_all([Path(args.root)], 1)
         else:
             print(f'Unable to find: {args.root}')
 
     else:
         debug('Running in multiple file mode')
-        file_list = list(Path(args.root).rglob("*.flac"))
+        file_list = sorted(Path(args.root).rglob("*.flac"))
         if len(file_list) > 0:
-            for in_file in sorted(file_list):
-                run_convert(in_file)
+            convert_all(file_list, max(1, args.jobs))
+
+    metrics.end()
+    print(metrics.summary())
+    if args.metrics:
+        metrics.write_json(args.metrics)
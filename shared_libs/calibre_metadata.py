@@ -0,0 +1,256 @@
+import sqlite3
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+CUSTOM_DATE_TYPES = ['datetime']
+CUSTOM_SKIP_TYPES = ['composite']
+
+LINKED_FIELDS = {
+    'authors': ('SELECT l.book, a.name FROM books_authors_link l JOIN authors a ON a.id = l.author '
+                'WHERE l.book IN ({selected}) ORDER BY l.id', ' & '.join),
+    'publisher': ('SELECT l.book, p.name FROM books_publishers_link l JOIN publishers p ON p.id = l.publisher '
+                  'WHERE l.book IN ({selected})', lambda values: values[0]),
+    'series': ('SELECT l.book, s.name FROM books_series_link l JOIN series s ON s.id = l.series '
+               'WHERE l.book IN ({selected})', lambda values: values[0]),
+    'tags': ('SELECT l.book, t.name FROM books_tags_link l JOIN tags t ON t.id = l.tag '
+             'WHERE l.book IN ({selected}) ORDER BY t.name', list),
+    'languages': ('SELECT l.book, g.lang_code FROM books_languages_link l JOIN languages g ON g.id = l.lang_code '
+                  'WHERE l.book IN ({selected}) ORDER BY l.item_order', list),
+    'rating': ('SELECT l.book, r.rating FROM books_ratings_link l JOIN ratings r ON r.id = l.rating '
+               'WHERE l.book IN ({selected})', lambda values: values[0]),
+    'comments': ('SELECT book, text FROM comments WHERE book IN ({selected})', lambda values: values[0]),
+    'identifiers': ("SELECT book, type || ':' || val FROM identifiers WHERE book IN ({selected})",
+                    lambda values: dict(value.split(':', 1) for value in values)),
+}
+
+
+def calibre_date(value: Optional[str]) -> Optional[str]:
+    """
+    Converts a metadata.db timestamp into the format `calibredb --for-machine` emits.
+
+    Args:
+        value: Stored value, e.g. '2024-05-01 12:34:56.123456+00:00'.
+
+    Returns:
+        ISO timestamp without microseconds, e.g. '2024-05-01T12:34:56+00:00'.
+    """
+    if not value:
+        return value
+    try:
+        return datetime.fromisoformat(value).replace(microsecond=0).isoformat()
+    except ValueError:
+        return value
+
+
+def db_timestamp(value: datetime) -> str:
+    """
+    Formats a datetime the way metadata.db stores timestamps, for range comparisons.
+
+    Args:
+        value: Aware (or local naive) datetime.
+
+    Returns:
+        UTC timestamp string, e.g. '2024-05-01 12:34:56+00:00'.
+    """
+    return value.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S+00:00')
+
+
+class CalibreMetadata:
+    """
+    Read-only reader for a Calibre library's metadata.db.
+
+    Produces records shaped like `calibredb list -f all --for-machine` output
+    (custom columns keyed as '*label'), with filters applied in SQL so only the
+    matching books are ever materialized.
+    """
+
+    def __init__(self, library_path: str | Path, debug_hook: Optional[Callable[[str, int], None]] = None):
+        """
+        Args:
+            library_path: Calibre library folder (the one containing metadata.db).
+            debug_hook: Optional callable to log debug info (e.g. `debugger.log`).
+        """
+        self.library_path = Path(library_path)
+        self._debug = debug_hook
+        db_path = self.library_path.joinpath('metadata.db')
+        self.conn = sqlite3.connect(f"{db_path.resolve().as_uri()}?mode=ro", uri=True)
+        self.custom_columns = {
+            row[1]: {'id': row[0], 'datatype': row[2], 'is_multiple': bool(row[3]), 'normalized': bool(row[4])}
+            for row in self.conn.execute(
+                'SELECT id, label, datatype, is_multiple, normalized FROM custom_columns WHERE mark_for_delete = 0')
+        }
+        self._log(f"Custom columns: {sorted(self.custom_columns)}", 3)
+
+    def _log(self, msg: str, level: int = 1) -> None:
+        if self._debug:
+            self._debug(msg, level)
+
+    def _custom_filter(self, label: str, value: str) -> Tuple[str, list]:
+        column = self.custom_columns.get(label)
+        if column is None:
+            self._log(f"No custom column '{label}', filter matches nothing", 1)
+            return '0', []
+        table = f"custom_column_{column['id']}"
+        if column['normalized']:
+            return (f"b.id IN (SELECT l.book FROM books_{table}_link l JOIN {table} c ON c.id = l.value "
+                    f"WHERE c.value = ?)", [value])
+        return f"b.id IN (SELECT book FROM {table} WHERE value = ?)", [value]
+
+    def _where(self, publisher: Optional[str], purchase: Optional[str], ids: Optional[Iterable[int]],
+               since: Optional[datetime], modified_since: Optional[datetime],
+               title: Optional[str]) -> Tuple[str, list]:
+        clauses = []
+        params = []
+        if publisher:
+            clauses.append('b.id IN (SELECT bpl.book FROM books_publishers_link bpl '
+                           'JOIN publishers p ON p.id = bpl.publisher WHERE p.name = ?)')
+            params.append(publisher)
+        if purchase:
+            clause, clause_params = self._custom_filter('purchase_location', purchase)
+            clauses.append(clause)
+            params.extend(clause_params)
+        if ids is not None:
+            ids = [int(book_id) for book_id in ids]
+            clauses.append(f"b.id IN ({','.join('?' * len(ids))})" if ids else '0')
+            params.extend(ids)
+        if since:
+            clauses.append('b.timestamp >= ?')
+            params.append(db_timestamp(since))
+        if modified_since:
+            clauses.append('(b.last_modified >= ? OR b.timestamp >= ?)')
+            params.extend([db_timestamp(modified_since)] * 2)
+        if title:
+            clauses.append('b.title = ?')
+            params.append(title)
+        return ' AND '.join(clauses) or '1', params
+
+    def _linked(self, sql: str, where: str, params: list) -> Dict[int, list]:
+        """
+        Runs a (book, value) query restricted to the selected books, grouped by book.
+        """
+        grouped = {}
+        for book, value in self.conn.execute(sql.format(selected=f"SELECT b.id FROM books b WHERE {where}"), params):
+            grouped.setdefault(book, []).append(value)
+        return grouped
+
+    def read(self, publisher: Optional[str] = None, purchase: Optional[str] = None,
+             ids: Optional[Iterable[int]] = None, since: Optional[datetime] = None,
+             modified_since: Optional[datetime] = None, title: Optional[str] = None,
+             fields: Optional[Iterable[str]] = None) -> List[dict]:
+        """
+        Reads the books matching every given filter.
+
+        Args:
+            publisher: Only books from this publisher.
+            purchase: Only books with this '#purchase_location'.
+            ids: Only these Calibre book ids.
+            since: Only books added at or after this time.
+            modified_since: Only books added or modified at or after this time.
+            title: Only books with exactly this title.
+            fields: Only read these linked/custom fields (default: all of them).
+
+        Returns:
+            List of calibredb-style records.
+        """
+        fields = set(fields) if fields is not None else None
+        where, params = self._where(publisher, purchase, ids, since, modified_since, title)
+        self._log(f"metadata.db filter: {where} {params}", 3)
+
+        records = {}
+        for row in self.conn.execute(
+                'SELECT b.id, b.title, b.sort, b.author_sort, b.timestamp, b.pubdate, b.series_index, '
+                f"b.last_modified, b.path, b.uuid, b.has_cover, b.isbn FROM books b WHERE {where}", params):
+            record = {
+                'id': row[0],
+                'title': row[1],
+                'title_sort': row[2],
+                'author_sort': row[3],
+                'timestamp': calibre_date(row[4]),
+                'pubdate': calibre_date(row[5]),
+                'series_index': row[6],
+                'last_modified': calibre_date(row[7]),
+                'uuid': row[9],
+                'formats': [],
+                'identifiers': {},
+            }
+            if row[10]:
+                record['cover'] = self.library_path.joinpath(row[8], 'cover.jpg').as_posix()
+            if row[11]:
+                record['isbn'] = row[11]
+            record['_path'] = row[8]
+            records[row[0]] = record
+        self._log(f"Selected {len(records)} books from metadata.db", 2)
+        if not records:
+            return []
+
+        for field, (sql, combine) in LINKED_FIELDS.items():
+            if fields is not None and field not in fields:
+                continue
+            for book, values in self._linked(sql, where, params).items():
+                records[book][field] = combine(values)
+        if fields is None or 'formats' in fields:
+            for book, files in self._linked(
+                    "SELECT book, name || '.' || lower(format) FROM data WHERE book IN ({selected})",
+                    where, params).items():
+                records[book]['formats'] = [self.library_path.joinpath(records[book]['_path'], name).as_posix()
+                                            for name in files]
+
+        for label, column in self.custom_columns.items():
+            if fields is None or f"*{label}" in fields:
+                self._read_custom(records, label, column, where, params)
+
+        for record in records.values():
+            del record['_path']
+        return list(records.values())
+
+    def read_lazy(self, book_id: str, field: str) -> Optional[str]:
+        """
+        Reads one deferred field of one book, for use as a `CalibreStore` loader.
+
+        Args:
+            book_id: Calibre book id.
+            field: Field name (only 'comments' is supported).
+
+        Returns:
+            The field value, or None if the book has none.
+        """
+        if field != 'comments':
+            return None
+        row = self.conn.execute('SELECT text FROM comments WHERE book = ?', (int(book_id),)).fetchone()
+        return row[0] if row else None
+
+    def __getstate__(self) -> dict:
+        return {'library_path': self.library_path}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(state['library_path'])
+
+    def _read_custom(self, records: Dict[int, dict], label: str, column: dict, where: str, params: list) -> None:
+        if column['datatype'] in CUSTOM_SKIP_TYPES:
+            return
+        table = f"custom_column_{column['id']}"
+        key = f"*{label}"
+
+        if column['normalized']:
+            extra = ', l.extra' if column['datatype'] == 'series' else ''
+            rows = self.conn.execute(
+                f"SELECT l.book, c.value{extra} FROM books_{table}_link l JOIN {table} c ON c.id = l.value "
+                f"WHERE l.book IN (SELECT b.id FROM books b WHERE {where}) ORDER BY l.id", params)
+        else:
+            rows = self.conn.execute(
+                f"SELECT book, value FROM {table} WHERE book IN (SELECT b.id FROM books b WHERE {where})", params)
+
+        for row in rows:
+            record = records[row[0]]
+            value = row[1]
+            if column['datatype'] == 'bool':
+                value = bool(value)
+            elif column['datatype'] in CUSTOM_DATE_TYPES:
+                value = calibre_date(value)
+            if column['is_multiple']:
+                record.setdefault(key, []).append(value)
+            else:
+                record[key] = value
+            if column['datatype'] == 'series':
+                record[f"{key}_index"] = row[2]
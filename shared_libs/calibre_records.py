@@ -0,0 +1,203 @@
+import codecs
+import json
+import zlib
+from collections.abc import Mapping
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, Optional
+
+
+class _Missing:
+    """
+    Marker for a field the Calibre record does not have (pickles back to the singleton).
+    """
+
+    def __reduce__(self) -> str:
+        return 'MISSING'
+
+    def __repr__(self) -> str:
+        return 'MISSING'
+
+
+MISSING = _Missing()
+
+
+class CalibreRecord(Mapping):
+    """
+    Read-only, dict-like view of one Calibre book backed by a single tuple.
+
+    Absent fields raise KeyError just like the calibredb JSON dicts did. Lazy fields
+    are either kept zlib-compressed or fetched from the store's loader on access.
+    """
+
+    __slots__ = ('book_id', 'store', 'values')
+
+    def __init__(self, book_id: str, store: 'CalibreStore', values: tuple):
+        self.book_id = book_id
+        self.store = store
+        self.values = values
+
+    def __getitem__(self, field: str):
+        index = self.store.index.get(field)
+        if index is None:
+            raise KeyError(field)
+        value = self.values[index]
+        if field in self.store.lazy_fields:
+            return self.store.load_lazy(self.book_id, field, value)
+        if value is MISSING:
+            raise KeyError(field)
+        return value
+
+    def __contains__(self, field) -> bool:
+        index = self.store.index.get(field)
+        if index is None:
+            return False
+        if self.values[index] is MISSING:
+            return field in self.store.lazy_fields and self.store.loader is not None
+        return True
+
+    def __iter__(self) -> Iterator[str]:
+        return (field for field in self.store.fields if field in self)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        shown = {field: self.values[index] for field, index in self.store.index.items()
+                 if field not in self.store.lazy_fields and self.values[index] is not MISSING}
+        return f"CalibreRecord({self.book_id}, {shown})"
+
+
+class CalibreStore(Mapping):
+    """
+    Compact collection of Calibre records keyed by book id (as a string).
+
+    Only the configured fields are kept, one tuple per book, so memory scales with
+    the number of selected books rather than with the full `-f all` dump.
+    """
+
+    def __init__(self, fields: Iterable[str], lazy_fields: Iterable[str] = (),
+                 loader: Optional[Callable[[str, str], Optional[str]]] = None):
+        """
+        Args:
+            fields: Field names to keep (e.g. 'title', '*purchase_location').
+            lazy_fields: Heavy fields (e.g. 'comments') kept compressed or loaded on access.
+            loader: Optional callable (book_id, field) -> value for lazy fields not kept in memory.
+        """
+        self.fields = tuple(dict.fromkeys([*fields, *lazy_fields]))
+        self.index = {field: i for i, field in enumerate(self.fields)}
+        self.lazy_fields = frozenset(lazy_fields)
+        self.loader = loader
+        self._records: Dict[str, CalibreRecord] = {}
+
+    def add(self, record: dict) -> CalibreRecord:
+        """
+        Stores the configured fields of a calibredb-style record.
+
+        Args:
+            record: Dict with at least an 'id' key.
+
+        Returns:
+            The compact record.
+        """
+        book_id = str(record['id'])
+        values = []
+        for field in self.fields:
+            value = record.get(field, MISSING)
+            if field in self.lazy_fields and isinstance(value, str):
+                value = zlib.compress(value.encode())
+            values.append(value)
+        compact = CalibreRecord(book_id, self, tuple(values))
+        self._records[book_id] = compact
+        return compact
+
+    def load_lazy(self, book_id: str, field: str, value):
+        """
+        Resolves a lazy field value, decompressing or calling the loader as needed.
+
+        Raises:
+            KeyError: If the book has no value for the field.
+        """
+        if isinstance(value, bytes):
+            return zlib.decompress(value).decode()
+        if value is MISSING and self.loader is not None:
+            value = self.loader(book_id, field)
+        if value is MISSING or value is None:
+            raise KeyError(field)
+        return value
+
+    def __getitem__(self, book_id: str) -> CalibreRecord:
+        return self._records[str(book_id)]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._records)
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+
+def iter_json_array(stream: BinaryIO, chunk_size: int = 64 * 1024) -> Iterator:
+    """
+    Yields the elements of a top-level JSON array as they arrive on a byte stream.
+
+    Only the element being decoded (plus one read chunk) is held in memory, so a
+    `calibredb list --for-machine` dump is never buffered whole. This is the
+    fallback used when ijson is not installed.
+
+    Args:
+        stream: Binary stream holding one UTF-8 JSON array (e.g. a subprocess pipe).
+        chunk_size: Bytes read at a time.
+
+    Yields:
+        Each decoded element, in order.
+
+    Raises:
+        ValueError: If the stream is not a single well-formed JSON array.
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    pos = 0
+    eof = False
+    state = 'start'
+    while True:
+        while pos < len(buffer) and buffer[pos].isspace():
+            pos += 1
+        if pos == len(buffer):
+            if eof:
+                raise ValueError('Truncated JSON array')
+            buffer, pos, eof = _read_more(stream, text, buffer, pos, chunk_size)
+            continue
+
+        char = buffer[pos]
+        if state == 'start':
+            if char != '[':
+                raise ValueError(f"Expected a JSON array, found {char!r}")
+            state = 'first'
+            pos += 1
+        elif char == ']' and state in ('first', 'separator'):
+            return
+        elif state == 'separator':
+            if char != ',':
+                raise ValueError(f"Expected ',' or ']' in JSON array, found {char!r}")
+            state = 'item'
+            pos += 1
+        else:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                buffer, pos, eof = _read_more(stream, text, buffer, pos, chunk_size)
+                continue
+            if not eof and (end == len(buffer) or buffer[end] not in ' \t\r\n,]'):
+                # A number cut at the chunk boundary still decodes; wait for its delimiter.
+                buffer, pos, eof = _read_more(stream, text, buffer, pos, chunk_size)
+                continue
+            yield value
+            pos = end
+            state = 'separator'
+
+
+def _read_more(stream: BinaryIO, text: codecs.IncrementalDecoder, buffer: str, pos: int,
+               chunk_size: int) -> tuple:
+    chunk = stream.read(chunk_size)
+    return buffer[pos:] + text.decode(chunk, final=not chunk), 0, not chunk
@@ -0,0 +1,226 @@
+import json
+import sqlite3
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, Iterator, Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    book_id INTEGER PRIMARY KEY,
+    epub_path TEXT NOT NULL,
+    epub_size INTEGER NOT NULL,
+    epub_mtime_ns INTEGER NOT NULL,
+    cbz_path TEXT NOT NULL,
+    cbz_hash TEXT,
+    comicinfo_inputs TEXT,
+    converted_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS watermarks (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS thumbnails (
+    publisher TEXT NOT NULL,
+    series TEXT NOT NULL,
+    volume REAL NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (publisher, series, volume)
+);
+CREATE TABLE IF NOT EXISTS journal (
+    run TEXT NOT NULL,
+    book_id INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    finished_at TEXT NOT NULL,
+    PRIMARY KEY (run, book_id)
+);
+"""
+
+
+class ConversionManifest:
+    """
+    Local SQLite record of every converted book, keyed by Calibre book id.
+
+    Lets a run decide "unchanged, skip" with one primary-key lookup per book
+    instead of asking Komga or stat'ing the output tree.
+    """
+
+    def __init__(self, path: str | Path, debug_hook: Optional[Callable[[str, int], None]] = None):
+        """
+        Args:
+            path: SQLite database file (created if missing).
+            debug_hook: Optional callable to log debug info (e.g. `debugger.log`).
+        """
+        self.path = Path(path)
+        self._debug = debug_hook
+        self.conn = sqlite3.connect(self.path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+    def _log(self, msg: str, level: int = 1) -> None:
+        if self._debug:
+            self._debug(msg, level)
+
+    def get(self, book_id: int) -> Optional[sqlite3.Row]:
+        """
+        Args:
+            book_id: Calibre book id.
+
+        Returns:
+            The manifest row, or None if the book has never been recorded.
+        """
+        return self.conn.execute('SELECT * FROM books WHERE book_id = ?', (int(book_id),)).fetchone()
+
+    def is_unchanged(self, book_id: int, epub_size: int, epub_mtime_ns: int) -> bool:
+        """
+        Args:
+            book_id: Calibre book id.
+            epub_size: Current size of the source epub.
+            epub_mtime_ns: Current modification time of the source epub.
+
+        Returns:
+            True if the book was recorded from an identical source epub.
+        """
+        row = self.get(book_id)
+        unchanged = row is not None and row['epub_size'] == epub_size and row['epub_mtime_ns'] == epub_mtime_ns
+        self._log(f"Manifest lookup for {book_id}: {'unchanged' if unchanged else 'new or changed'}", 3)
+        return unchanged
+
+    def record(self, book_id: int, epub_path: str, epub_size: int, epub_mtime_ns: int, cbz_path: str,
+               cbz_hash: Optional[str] = None, comicinfo_inputs: Optional[dict] = None,
+               converted_at: Optional[str] = None) -> None:
+        """
+        Inserts or replaces the entry for a book.
+
+        Args:
+            book_id: Calibre book id.
+            epub_path: Source epub path.
+            epub_size: Source epub size in bytes.
+            epub_mtime_ns: Source epub modification time.
+            cbz_path: Output cbz path.
+            cbz_hash: Hex digest of the output cbz.
+            comicinfo_inputs: Calibre fields the ComicInfo.xml was built from.
+            converted_at: ISO timestamp of the conversion (default: now).
+        """
+        converted_at = converted_at or datetime.now(timezone.utc).isoformat(timespec='seconds')
+        inputs = json.dumps(comicinfo_inputs, sort_keys=True) if comicinfo_inputs is not None else None
+        self.conn.execute(
+            'INSERT OR REPLACE INTO books VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (int(book_id), epub_path, epub_size, epub_mtime_ns, cbz_path, cbz_hash, inputs, converted_at),
+        )
+        self.conn.commit()
+        self._log(f"Recorded book {book_id} -> {cbz_path}", 3)
+
+    def clear(self) -> None:
+        """
+        Removes every entry (used before a rebuild).
+        """
+        self.conn.execute('DELETE FROM books')
+        self.conn.commit()
+
+    def get_watermark(self, name: str) -> Optional[str]:
+        """
+        Args:
+            name: Watermark name (e.g. one per publisher/purchase filter).
+
+        Returns:
+            The stored high-water mark, or None if never set.
+        """
+        row = self.conn.execute('SELECT value FROM watermarks WHERE name = ?', (name,)).fetchone()
+        return row['value'] if row else None
+
+    def set_watermark(self, name: str, value: str) -> None:
+        """
+        Args:
+            name: Watermark name.
+            value: New high-water mark (ISO timestamp).
+        """
+        self.conn.execute('INSERT OR REPLACE INTO watermarks VALUES (?, ?)', (name, value))
+        self.conn.commit()
+        self._log(f"Watermark {name} set to {value}", 2)
+
+    def journal_entries(self, run: str) -> Dict[int, str]:
+        """
+        Args:
+            run: Journal name (one per command line selection).
+
+        Returns:
+            Book id -> status for every book the interrupted run recorded, failures included.
+        """
+        rows = self.conn.execute('SELECT book_id, status FROM journal WHERE run = ?', (run,))
+        return {row['book_id']: row['status'] for row in rows}
+
+    def journal_record(self, run: str, book_id: int, status: str) -> None:
+        """
+        Marks a book as finished in a run, committed immediately so a crash keeps it.
+
+        Args:
+            run: Journal name.
+            book_id: Calibre book id.
+            status: Conversion status of the book.
+        """
+        finished_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        self.conn.execute('INSERT OR REPLACE INTO journal VALUES (?, ?, ?, ?)',
+                          (run, int(book_id), status, finished_at))
+        self.conn.commit()
+        self._log(f"Journal {run}: {book_id} {status}", 3)
+
+    def journal_clear(self, run: str) -> None:
+        """
+        Forgets a run once it has completed (or when it should start over).
+
+        Args:
+            run: Journal name.
+        """
+        self.conn.execute('DELETE FROM journal WHERE run = ?', (run,))
+        self.conn.commit()
+        self._log(f"Journal {run} cleared", 2)
+
+    def add_thumbnail(self, publisher: str, series: str, volume: float, data: bytes) -> None:
+        """
+        Queues a thumbnail until Komga has indexed its book.
+
+        Args:
+            publisher: Publisher of the volume.
+            series: Series name as matched against Komga.
+            volume: Volume number.
+            data: JPEG bytes.
+        """
+        self.conn.execute('INSERT OR REPLACE INTO thumbnails VALUES (?, ?, ?, ?)', (publisher, series, volume, data))
+        self.conn.commit()
+
+    def remove_thumbnail(self, publisher: str, series: str, volume: float) -> None:
+        """
+        Drops a queued thumbnail once it has been uploaded.
+
+        Args:
+            publisher: Publisher of the volume.
+            series: Series name.
+            volume: Volume number.
+        """
+        self.conn.execute('DELETE FROM thumbnails WHERE publisher = ? AND series = ? AND volume = ?',
+                          (publisher, series, volume))
+        self.conn.commit()
+
+    def thumbnails(self) -> Iterator[sqlite3.Row]:
+        """
+        Returns:
+            Every queued thumbnail (publisher, series, volume, data).
+        """
+        return self.conn.execute('SELECT * FROM thumbnails ORDER BY series, volume')
+
+    def rows(self) -> Iterator[sqlite3.Row]:
+        """
+        Returns:
+            Every manifest row, ordered by book id.
+        """
+        return self.conn.execute('SELECT * FROM books ORDER BY book_id')
+
+    def __len__(self) -> int:
+        return self.conn.execute('SELECT COUNT(*) FROM books').fetchone()[0]
+
+    def close(self) -> None:
+        """
+        Closes the database connection.
+        """
+        self.conn.close()
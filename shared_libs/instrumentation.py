@@ -0,0 +1,218 @@
+import functools
+import json
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from time import perf_counter
+from typing import Callable, Dict, Iterator, Optional
+
+try:
+    import sentry_sdk as _sentry_sdk
+except ImportError:
+    _sentry_sdk = None
+
+sentry_sdk = _sentry_sdk  # expose for tests
+
+
+def _sentry_active() -> bool:
+    if sentry_sdk is None:
+        return False
+    get_client = getattr(sentry_sdk, 'get_client', None)
+    if get_client is not None:
+        return get_client().is_active()
+    return sentry_sdk.Hub.current.client is not None
+
+
+class StageTimer:
+    """
+    Handle yielded by `Metrics.timer` to add item/byte counts while a stage runs.
+    """
+
+    __slots__ = ('items', 'bytes')
+
+    def __init__(self, items: int = 0, bytes: int = 0):
+        self.items = items
+        self.bytes = bytes
+
+    def add(self, items: int = 0, bytes: int = 0) -> None:
+        """
+        Args:
+            items: Items processed (files, pages, requests, ...).
+            bytes: Bytes read or written.
+        """
+        self.items += items
+        self.bytes += bytes
+
+
+class Metrics:
+    """
+    Collects per-stage timings plus item and byte counters for one script run.
+
+    Stages are timed with the `timer` context manager or the `timed` decorator,
+    can be merged across worker processes via `snapshot`/`merge`, and are
+    reported as a summary table or a JSON file. When Sentry is initialized with
+    tracing, each run is a transaction and each timed stage a span.
+    """
+
+    def __init__(self, name: str, debug_hook: Optional[Callable[[str, int], None]] = None):
+        """
+        Args:
+            name: Script or run name (used as the Sentry transaction name).
+            debug_hook: Optional callable to log debug info (e.g. `debugger.log`).
+        """
+        self.name = name
+        self._debug = debug_hook
+        self._lock = threading.Lock()
+        self.stages: Dict[str, dict] = {}
+        self._transaction = None
+
+    def _log(self, msg: str, level: int = 1) -> None:
+        if self._debug:
+            self._debug(msg, level)
+
+    def record(self, stage: str, seconds: float, calls: int = 1, items: int = 0, bytes: int = 0) -> None:
+        """
+        Adds one (or several, when merging) timed calls to a stage.
+
+        Args:
+            stage: Stage name.
+            seconds: Elapsed wall-clock seconds.
+            calls: Number of calls the time covers.
+            items: Items processed.
+            bytes: Bytes processed.
+        """
+        with self._lock:
+            stats = self.stages.setdefault(stage, {'calls': 0, 'seconds': 0.0, 'max': 0.0, 'items': 0, 'bytes': 0})
+            stats['calls'] += calls
+            stats['seconds'] += seconds
+            stats['max'] = max(stats['max'], seconds if calls == 1 else 0.0)
+            stats['items'] += items
+            stats['bytes'] += bytes
+
+    @contextmanager
+    def timer(self, stage: str, items: int = 0, bytes: int = 0, description: Optional[str] = None) \
+            -> Iterator[StageTimer]:
+        """
+        Times a block as one call of a stage (and a Sentry span, if tracing).
+
+        Args:
+            stage: Stage name.
+            items: Items known up front.
+            bytes: Bytes known up front.
+            description: Optional span description (e.g. the file being processed).
+
+        Yields:
+            A `StageTimer` whose `add` updates the counters from inside the block.
+        """
+        counters = StageTimer(items, bytes)
+        span = sentry_sdk.start_span(op=stage, description=description) if _sentry_active() else None
+        start = perf_counter()
+        try:
+            if span is not None:
+                with span:
+                    yield counters
+                    span.set_data('items', counters.items)
+                    span.set_data('bytes', counters.bytes)
+            else:
+                yield counters
+        finally:
+            elapsed = perf_counter() - start
+            self.record(stage, elapsed, items=counters.items, bytes=counters.bytes)
+            self._log(f"[metrics] {stage}: {elapsed:.3f}s ({counters.items} items, {counters.bytes} bytes)", 3)
+
+    def timed(self, stage: str) -> Callable:
+        """
+        Decorator that times every call of a function as a stage.
+
+        Args:
+            stage: Stage name.
+        """
+        def decorator(func: Callable) -> Callable:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(stage):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def begin(self, op: str = 'script') -> None:
+        """
+        Starts the run's Sentry transaction when tracing is enabled (see `transaction`).
+
+        Args:
+            op: Transaction operation name.
+        """
+        if _sentry_active() and self._transaction is None:
+            self._transaction = sentry_sdk.start_transaction(op=op, name=self.name)
+            self._transaction.__enter__()
+
+    def end(self) -> None:
+        """
+        Finishes the transaction started by `begin`, if any.
+        """
+        if self._transaction is not None:
+            self._transaction.__exit__(None, None, None)
+            self._transaction = None
+
+    @contextmanager
+    def transaction(self, op: str = 'script') -> Iterator[None]:
+        """
+        Wraps a whole run in a Sentry transaction when tracing is enabled.
+
+        Args:
+            op: Transaction operation name.
+        """
+        self.begin(op)
+        try:
+            yield
+        finally:
+            self.end()
+
+    def snapshot(self) -> Dict[str, dict]:
+        """
+        Returns:
+            A picklable copy of the stage counters (e.g. to send back from a worker).
+        """
+        with self._lock:
+            return {stage: dict(stats) for stage, stats in self.stages.items()}
+
+    def merge(self, snapshot: Dict[str, dict]) -> None:
+        """
+        Adds the counters from another `Metrics.snapshot()`.
+
+        Args:
+            snapshot: Stage counters from a worker.
+        """
+        for stage, stats in snapshot.items():
+            self.record(stage, stats['seconds'], stats['calls'], stats['items'], stats['bytes'])
+            with self._lock:
+                self.stages[stage]['max'] = max(self.stages[stage]['max'], stats['max'])
+
+    def reset(self) -> None:
+        """
+        Clears every counter.
+        """
+        with self._lock:
+            self.stages.clear()
+
+    def summary(self) -> str:
+        """
+        Returns:
+            A text table of every stage, slowest first.
+        """
+        rows = [f"{'stage':<20} {'calls':>7} {'total s':>10} {'avg ms':>9} {'max ms':>9} {'items':>8} {'MB':>9}"]
+        for stage, stats in sorted(self.snapshot().items(), key=lambda entry: -entry[1]['seconds']):
+            average = stats['seconds'] / stats['calls'] * 1000 if stats['calls'] else 0.0
+            rows.append(f"{stage:<20} {stats['calls']:>7} {stats['seconds']:>10.3f} {average:>9.1f} "
+                        f"{stats['max'] * 1000:>9.1f} {stats['items']:>8} {stats['bytes'] / 1048576:>9.2f}")
+        return '\n'.join(rows)
+
+    def write_json(self, path: str | Path) -> None:
+        """
+        Writes the stage counters to a JSON file.
+
+        Args:
+            path: Output file.
+        """
+        Path(path).write_text(json.dumps({'name': self.name, 'stages': self.snapshot()}, indent=1) + '\n')
+        self._log(f"Metrics written to {path}", 2)
@@ -0,0 +1,317 @@
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth
+from urllib3.util.retry import Retry
+
+TOKEN_HEADER = 'X-Auth-Token'
+LOGIN_PATH = '/api/v2/users/me'
+
+
+class KomgaError(Exception):
+    """
+    Raised when the Komga API cannot be reached or returns an error status.
+    """
+
+
+class KomgaClient:
+    """
+    Pooled, keep-alive client for the Komga REST API.
+
+    All requests share one `requests.Session`, are retried with backoff on 429/5xx,
+    and are capped at `concurrency` in flight at once across every thread using
+    the client.
+
+    The password is only sent once: the client logs in with Basic auth, keeps the
+    session token Komga returns in `X-Auth-Token` and sends that on every other
+    request (Komga verifies a password hash for each Basic-auth request). The token
+    can be cached in a private file between runs; when the server rejects it the
+    client logs in again and retries the request. Servers that return no token keep
+    getting Basic auth.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        username: str,
+        password: str,
+        timeout: float | Tuple[float, float] = (5, 30),
+        retries: int = 3,
+        backoff: float = 0.5,
+        concurrency: int = 4,
+        token_file: Optional[str | Path] = None,
+        debug_hook: Optional[Callable[[str, int], None]] = None,
+    ):
+        """
+        Args:
+            base_url: Server root, e.g. 'https://komga.local'.
+            username: Komga username.
+            password: Komga password (surrounding single quotes are stripped).
+            timeout: Requests timeout, either total seconds or (connect, read).
+            retries: Maximum retries for connection errors and 429/5xx responses.
+            backoff: Exponential backoff factor between retries, in seconds.
+            concurrency: Maximum number of requests in flight at once.
+            token_file: Optional file to cache the session token in between runs (mode 0600).
+            debug_hook: Optional callable to log debug info (e.g. `debugger.log`).
+        """
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.concurrency = max(1, concurrency)
+        self._debug = debug_hook
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+        self._basic_auth = HTTPBasicAuth(username, password.strip("'"))
+        self._token_key = f"{username}@{self.base_url}"
+        self._token_file = Path(token_file) if token_file else None
+        self._token_lock = threading.Lock()
+        self._token = self._load_token()
+        self._logged_in = self._token is not None
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=(429, 500, 502, 503, 504),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _log(self, msg: str, level: int = 1) -> None:
+        if self._debug:
+            self._debug(msg, level)
+
+    def _load_token(self) -> Optional[str]:
+        if not self._token_file or not self._token_file.exists():
+            return None
+        if self._token_file.stat().st_mode & 0o077:
+            self._log(f"Ignoring Komga token file {self._token_file}: readable by other users", 1)
+            return None
+        try:
+            tokens = json.loads(self._token_file.read_text())
+        except (OSError, ValueError) as e:
+            self._log(f"Ignoring unreadable Komga token file {self._token_file}: {e}", 1)
+            return None
+        token = tokens.get(self._token_key)
+        if token:
+            self._log(f"Reusing cached Komga session for {self._token_key}", 2)
+        return token
+
+    def _save_token(self, token: Optional[str]) -> None:
+        if not self._token_file:
+            return
+        tokens = {}
+        if self._token_file.exists() and not self._token_file.stat().st_mode & 0o077:
+            try:
+                tokens = json.loads(self._token_file.read_text())
+            except (OSError, ValueError):
+                tokens = {}
+        if token:
+            tokens[self._token_key] = token
+        else:
+            tokens.pop(self._token_key, None)
+
+        tmp_path = self._token_file.with_name(f".{self._token_file.name}.tmp")
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            os.fchmod(fd, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(tokens, f)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        os.replace(tmp_path, self._token_file)
+        self._log(f"Saved Komga session token to {self._token_file}", 3)
+
+    def _set_token(self, token: Optional[str]) -> None:
+        if token != self._token:
+            self._token = token
+            self._save_token(token)
+
+    def login(self, stale: Optional[str] = None) -> Optional[str]:
+        """
+        Authenticates with the password and keeps the session token Komga returns.
+
+        Only one thread logs in at a time; a thread whose token was already replaced
+        by another thread's login reuses the new token instead of logging in again.
+
+        Args:
+            stale: The token that was rejected, if any.
+
+        Returns:
+            The session token, or None when the server does not hand one out.
+
+        Raises:
+            KomgaError: On connection failure or when the credentials are rejected.
+        """
+        with self._token_lock:
+            if self._logged_in and self._token != stale:
+                return self._token
+
+            url = f"{self.base_url}{LOGIN_PATH}"
+            self._log(f"Logging in to Komga as {self._token_key}", 2)
+            with self._slots:
+                try:
+                    r = self.session.get(url, params={'remember-me': 'true'}, auth=self._basic_auth,
+                                         timeout=self.timeout)
+                except requests.RequestException as e:
+                    raise KomgaError(f"Login to {self.base_url} failed: {e}") from e
+            if not r.ok:
+                raise KomgaError(f"Login to {self.base_url} returned {r.status_code}")
+
+            token = r.headers.get(TOKEN_HEADER)
+            if not token:
+                self._log("Komga returned no session token, using Basic auth for every request", 1)
+            self._set_token(token)
+            self._logged_in = True
+            return token
+
+    def _send(self, method: str, url: str, token: Optional[str], params: Optional[Dict[str, str]],
+              **kwargs) -> requests.Response:
+        if token:
+            kwargs['headers'] = {**kwargs.get('headers', {}), TOKEN_HEADER: token}
+        else:
+            kwargs['auth'] = self._basic_auth
+        with self._slots:
+            try:
+                return self.session.request(method, url, params=params, timeout=self.timeout, **kwargs)
+            except requests.RequestException as e:
+                raise KomgaError(f"{method} {url} failed: {e}") from e
+
+    def request(self, method: str, path: str, params: Optional[Dict[str, str]] = None,
+                **kwargs) -> requests.Response:
+        """
+        Sends a request through the shared session, logging in first if needed.
+
+        A 401 on a session token means the session expired (or was revoked): the
+        client logs in again and retries the request once with the new token.
+
+        Args:
+            method: HTTP method.
+            path: API path, e.g. '/api/v1/series'.
+            params: Optional query parameters.
+            **kwargs: Extra `requests.Session.request` arguments (json, files, ...).
+
+        Returns:
+            The successful response.
+
+        Raises:
+            KomgaError: On connection failure or a non-2xx response after retries.
+        """
+        url = f"{self.base_url}{path}"
+        self._log(f" Calling {method} {url} {params or ''}", 3)
+        token = self._token if self._logged_in else self.login()
+        r = self._send(method, url, token, params, **kwargs)
+        if r.status_code == 401 and token:
+            self._log("Komga session expired, logging in again", 2)
+            token = self.login(stale=token)
+            r = self._send(method, url, token, params, **kwargs)
+
+        renewed = r.headers.get(TOKEN_HEADER)
+        if token and renewed and renewed != token:
+            with self._token_lock:
+                if self._token == token:
+                    self._set_token(renewed)
+
+        if not r.ok:
+            raise KomgaError(f"{method} {url} returned {r.status_code}")
+        self._log(f"API Returned {r.status_code}", 3)
+        return r
+
+    def get_json(self, path: str, params: Optional[Dict[str, str]] = None):
+        """
+        Args:
+            path: API path.
+            params: Optional query parameters.
+
+        Returns:
+            The decoded JSON body.
+        """
+        return self.request('GET', path, params).json()
+
+    def get_all(self, path: str, params: Optional[Dict[str, str]] = None, page_size: int = 500) -> List[dict]:
+        """
+        Fetches every page of a paginated endpoint.
+
+        The first page is fetched to learn the page count, the rest are fetched
+        concurrently (bounded by the client's concurrency cap).
+
+        Args:
+            path: API path of a paginated endpoint.
+            params: Optional query parameters (page/size are filled in).
+            page_size: Number of entries requested per page.
+
+        Returns:
+            The concatenated `content` of every page, in page order.
+        """
+        params = dict(params or {})
+        params['size'] = str(page_size)
+
+        def fetch(page_number: int) -> dict:
+            return self.get_json(path, {**params, 'page': str(page_number)})
+
+        first = fetch(0)
+        content = list(first['content'])
+        total_pages = first.get('totalPages', 1)
+        self._log(f" {path}: {first.get('totalElements', len(content))} entries over {total_pages} pages", 3)
+
+        if total_pages > 1:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+                for page in pool.map(fetch, range(1, total_pages)):
+                    content.extend(page['content'])
+        return content
+
+    def libraries(self) -> List[dict]:
+        """
+        Returns:
+            Every library (id, name, root, ...) visible to the user.
+        """
+        return self.get_json('/api/v1/libraries')
+
+    def scan_library(self, library_id: str) -> None:
+        """
+        Asks Komga to scan one library for new, changed and removed files.
+
+        Args:
+            library_id: Komga library id.
+        """
+        self._log(f"Requesting scan of library {library_id}", 2)
+        self.request('POST', f"/api/v1/libraries/{library_id}/scan")
+
+    def analyze_series(self, series_id: str) -> None:
+        """
+        Asks Komga to re-analyze the books of one series and refresh its metadata.
+
+        Args:
+            series_id: Komga series id.
+        """
+        self._log(f"Requesting analyze and metadata refresh of series {series_id}", 2)
+        self.request('POST', f"/api/v1/series/{series_id}/analyze")
+        self.request('POST', f"/api/v1/series/{series_id}/metadata/refresh")
+
+    def upload_book_thumbnail(self, book_id: str, data: bytes, selected: bool = True) -> None:
+        """
+        Uploads a JPEG thumbnail for a book, so Komga does not have to render one.
+
+        Args:
+            book_id: Komga book id.
+            data: JPEG bytes.
+            selected: Make it the thumbnail Komga shows for the book.
+        """
+        self._log(f"Uploading {len(data)} byte thumbnail for book {book_id}", 3)
+        self.request('POST', f"/api/v1/books/{book_id}/thumbnails", {'selected': str(selected).lower()},
+                     files={'file': ('thumbnail.jpg', data, 'image/jpeg')})
+
+    def close(self) -> None:
+        """
+        Closes the pooled connections. The session token stays valid (and cached) for the next run.
+        """
+        self.session.close()
@@ -0,0 +1,320 @@
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Dict, Optional, Set
+
+if TYPE_CHECKING:
+    from shared_libs.komga_client import KomgaClient
+
+INDEX_VERSION = 1
+
+
+def normalize_name(name: str) -> str:
+    """
+    Normalizes a series name for lookups (case-insensitive, collapsed whitespace).
+
+    Args:
+        name: Series name as stored in Calibre or Komga.
+
+    Returns:
+        The normalized lookup key.
+    """
+    return ' '.join(name.casefold().split())
+
+
+def normalize_number(number) -> str:
+    """
+    Normalizes a single volume number so '3', '3.0' and 3 all compare equal.
+
+    Args:
+        number: Volume number as a string, int or float.
+
+    Returns:
+        The normalized number string.
+    """
+    text = str(number).strip()
+    try:
+        value = float(text)
+    except ValueError:
+        return text
+    if value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def expand_number(number: str) -> Set[str]:
+    """
+    Expands a Komga book number into every volume it covers.
+
+    Combo volumes are written either as a list ('1,2') or as a range ('1-3').
+
+    Args:
+        number: The book's metadata number.
+
+    Returns:
+        Set of normalized volume numbers.
+    """
+    number = str(number).strip()
+    if ',' in number:
+        return {normalize_number(part) for part in number.split(',') if part.strip()}
+    if '-' in number.lstrip('-'):
+        start, end = number.rsplit('-', 1)
+        try:
+            return {str(i) for i in range(int(float(start)), int(float(end)) + 1)}
+        except ValueError:
+            return {number}
+    return {normalize_number(number)}
+
+
+def _parse_modified(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def _newest(current: Optional[str], candidate: Optional[str]) -> Optional[str]:
+    if not candidate:
+        return current
+    if not current or _parse_modified(candidate) > _parse_modified(current):
+        return candidate
+    return current
+
+
+def _is_newer(value: Optional[str], mark: Optional[str]) -> bool:
+    if not mark:
+        return True
+    if not value:
+        return False
+    return _parse_modified(value) >= _parse_modified(mark)
+
+
+class KomgaIndex:
+    """
+    In-memory snapshot of every Komga series and book, keyed for volume lookups.
+
+    The snapshot can be persisted to disk and refreshed incrementally using the
+    lastModified fields Komga exposes on series and books.
+    """
+
+    def __init__(self, debug_hook: Optional[Callable[[str, int], None]] = None):
+        """
+        Args:
+            debug_hook: Optional callable to log debug info (e.g. `debugger.log`).
+        """
+        self.series: Dict[str, dict] = {}
+        self.books: Dict[str, dict] = {}
+        self.series_modified: Optional[str] = None
+        self.books_modified: Optional[str] = None
+        self._debug = debug_hook
+        self._names: Dict[str, str] = {}
+        self._volumes: Dict[str, Dict[str, Set[str]]] = {}
+
+    def _log(self, msg: str, level: int = 1) -> None:
+        if self._debug:
+            self._debug(msg, level)
+
+    def find_series(self, name: str) -> Optional[str]:
+        """
+        Args:
+            name: Series name (normalized internally).
+
+        Returns:
+            The Komga series id, or None if the series is unknown.
+        """
+        return self._names.get(normalize_name(name))
+
+    def has_volume(self, series_id: str, volume) -> bool:
+        """
+        Args:
+            series_id: Komga series id.
+            volume: Volume number (Calibre series_index).
+
+        Returns:
+            True if any book in the series covers that volume.
+        """
+        return normalize_number(volume) in self._volumes.get(series_id, {})
+
+    def find_books(self, series_id: str, volume) -> Set[str]:
+        """
+        Args:
+            series_id: Komga series id.
+            volume: Volume number (Calibre series_index).
+
+        Returns:
+            The ids of the books covering that volume (empty if none).
+        """
+        return self._volumes.get(series_id, {}).get(normalize_number(volume), set())
+
+    def volumes(self, series_id: str) -> Dict[str, Set[str]]:
+        """
+        Args:
+            series_id: Komga series id.
+
+        Returns:
+            Mapping of volume number to the ids of the books covering it.
+        """
+        return self._volumes.get(series_id, {})
+
+    @classmethod
+    def load(cls, path: str | Path, debug_hook: Optional[Callable[[str, int], None]] = None) -> 'KomgaIndex':
+        """
+        Loads a persisted index. A missing or unreadable file yields an empty index.
+
+        Args:
+            path: JSON file written by `save`.
+            debug_hook: Optional callable to log debug info.
+
+        Returns:
+            The loaded (possibly empty) index.
+        """
+        index = cls(debug_hook)
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            index._log(f"No Komga index at {path}, starting empty", 2)
+            return index
+        except (OSError, ValueError) as e:
+            index._log(f"Unable to read Komga index {path}: {e}", 1)
+            return index
+
+        if data.get('version') != INDEX_VERSION:
+            index._log("Komga index version mismatch, starting empty", 1)
+            return index
+
+        index.series = data.get('series', {})
+        index.books = data.get('books', {})
+        index.series_modified = data.get('series_modified')
+        index.books_modified = data.get('books_modified')
+        index._rebuild_lookups()
+        index._log(f"Loaded Komga index: {len(index.series)} series, {len(index.books)} books", 2)
+        return index
+
+    def save(self, path: str | Path) -> None:
+        """
+        Atomically writes the index to disk.
+
+        Args:
+            path: Destination JSON file.
+        """
+        data = {
+            'version': INDEX_VERSION,
+            'series_modified': self.series_modified,
+            'books_modified': self.books_modified,
+            'series': self.series,
+            'books': self.books,
+        }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+        self._log(f"Saved Komga index to {path}", 3)
+
+    def refresh(self, client: 'KomgaClient', full: bool = False, page_size: int = 500) -> None:
+        """
+        Brings the index up to date with the server.
+
+        An empty index (or `full=True`) pages through every series and book once,
+        fetching pages concurrently. Otherwise only entries modified since the stored
+        high-water marks are fetched, falling back to a full rebuild if the totals
+        show something was deleted.
+
+        Args:
+            client: Komga client used for the API calls.
+            full: Force a complete rebuild.
+            page_size: Number of entries requested per page.
+        """
+        if full or not self.series:
+            self._full_refresh(client, page_size)
+            return
+
+        series_total = self._update('/api/v1/series', client, page_size, self.series_modified, self._add_series)
+        books_total = self._update('/api/v1/books', client, page_size, self.books_modified, self._add_book)
+
+        if series_total != len(self.series) or books_total != len(self.books):
+            self._log('Komga totals changed underneath the index, rebuilding', 1)
+            self._full_refresh(client, page_size)
+            return
+
+        self._rebuild_lookups()
+
+    def _full_refresh(self, client: 'KomgaClient', page_size: int) -> None:
+        self._log('Building full Komga index', 1)
+        self.series = {}
+        self.books = {}
+        self.series_modified = self._load_all('/api/v1/series', client, page_size, self._add_series)
+        self.books_modified = self._load_all('/api/v1/books', client, page_size, self._add_book)
+        self._rebuild_lookups()
+
+    def _load_all(self, path: str, client: 'KomgaClient', page_size: int,
+                  add: Callable[[dict], None]) -> Optional[str]:
+        """
+        Loads every entry of an endpoint.
+
+        Returns:
+            The newest lastModified seen, to use as the next high-water mark.
+        """
+        newest = None
+        for entry in client.get_all(path, {'sort': 'lastModified,desc'}, page_size):
+            add(entry)
+            newest = _newest(newest, entry.get('lastModified'))
+        self._log(f"Loaded {path} (newest: {newest})", 2)
+        return newest
+
+    def _update(self, path: str, client: 'KomgaClient', page_size: int, mark: Optional[str],
+                add: Callable[[dict], None]) -> int:
+        """
+        Walks an endpoint newest-first, stopping once entries are older than `mark`.
+
+        Returns:
+            The server-side total element count for the endpoint.
+        """
+        total = 0
+        newest = mark
+        page_number = 0
+        while True:
+            page = client.get_json(path, {'page': str(page_number), 'size': str(page_size),
+                                          'sort': 'lastModified,desc'})
+            total = page.get('totalElements', total)
+            done = page.get('last', True)
+            for entry in page['content']:
+                modified = entry.get('lastModified')
+                if not _is_newer(modified, mark):
+                    done = True
+                    break
+                add(entry)
+                newest = _newest(newest, modified)
+            if done:
+                break
+            page_number += 1
+
+        if path.endswith('series'):
+            self.series_modified = newest
+        else:
+            self.books_modified = newest
+        self._log(f"Updated {path} (total: {total}, newest: {newest})", 2)
+        return total
+
+    def _add_series(self, entry: dict) -> None:
+        self.series[entry['id']] = {
+            'name': entry['name'],
+            'title': entry.get('metadata', {}).get('title', entry['name']),
+            'library_id': entry.get('libraryId'),
+        }
+
+    def _add_book(self, entry: dict) -> None:
+        self.books[entry['id']] = {
+            'series_id': entry['seriesId'],
+            'number': entry.get('metadata', {}).get('number', entry.get('number', '')),
+        }
+
+    def _rebuild_lookups(self) -> None:
+        self._names = {}
+        for series_id, data in self.series.items():
+            self._names[normalize_name(data['name'])] = series_id
+            self._names.setdefault(normalize_name(data['title']), series_id)
+
+        self._volumes = {}
+        for book_id, data in self.books.items():
+            volumes = self._volumes.setdefault(data['series_id'], {})
+            for number in expand_number(data['number']):
+                volumes.setdefault(number, set()).add(book_id)
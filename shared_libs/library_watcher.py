@@ -0,0 +1,124 @@
+import threading
+from pathlib import Path
+from time import monotonic, sleep
+from typing import Callable, Optional, Tuple
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    FileSystemEventHandler = object
+    Observer = None
+
+DB_FILES = ('metadata.db', 'metadata.db-wal', 'metadata.db-journal')
+
+
+class _DbEventHandler(FileSystemEventHandler):
+    def __init__(self, watcher: 'LibraryWatcher'):
+        super().__init__()
+        self.watcher = watcher
+
+    def on_any_event(self, event) -> None:
+        paths = [event.src_path, getattr(event, 'dest_path', '')]
+        if any(Path(path).name in DB_FILES for path in paths if path):
+            self.watcher.notify()
+
+
+class LibraryWatcher:
+    """
+    Waits for a Calibre library's metadata.db to change, with debouncing.
+
+    Calibre commits every add/edit to metadata.db after writing the book files,
+    so only the database (not the whole library tree) is watched. Uses watchdog
+    (inotify/FSEvents) when installed and falls back to polling the database's
+    size and mtime otherwise.
+    """
+
+    def __init__(self, library_path: str | Path, interval: float = 2.0, debounce: float = 5.0,
+                 use_watchdog: bool = True, debug_hook: Optional[Callable[[str, int], None]] = None):
+        """
+        Args:
+            library_path: Calibre library folder (the one containing metadata.db).
+            interval: Seconds between polls (or between checks of the event flag).
+            debounce: Seconds without further changes before a burst counts as finished.
+            use_watchdog: Use filesystem events when watchdog is installed.
+            debug_hook: Optional callable to log debug info (e.g. `debugger.log`).
+        """
+        self.library_path = Path(library_path)
+        self.interval = interval
+        self.debounce = debounce
+        self._debug = debug_hook
+        self._lock = threading.Lock()
+        self._changed = threading.Event()
+        self._last_change = None
+        self._state = self._db_state()
+        self._observer = None
+        if use_watchdog and Observer is not None:
+            self._observer = Observer()
+            self._observer.schedule(_DbEventHandler(self), str(self.library_path), recursive=False)
+            self._observer.start()
+            self._log(f"Watching {self.library_path} with {type(self._observer).__name__}", 2)
+        else:
+            self._log(f"Polling {self.library_path.joinpath('metadata.db')} every {interval}s", 2)
+
+    def _log(self, msg: str, level: int = 1) -> None:
+        if self._debug:
+            self._debug(msg, level)
+
+    def _db_state(self) -> Tuple[Tuple[int, int], ...]:
+        state = []
+        for name in DB_FILES:
+            try:
+                stat = self.library_path.joinpath(name).stat()
+                state.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                state.append((0, 0))
+        return tuple(state)
+
+    def notify(self) -> None:
+        """
+        Records a change (called from the watchdog thread, or by a poll).
+        """
+        with self._lock:
+            self._last_change = monotonic()
+        self._changed.set()
+
+    def _poll(self) -> None:
+        state = self._db_state()
+        if state != self._state:
+            self._state = state
+            self.notify()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Blocks until metadata.db changed and then stayed quiet for `debounce` seconds.
+
+        Args:
+            timeout: Give up after this many seconds (default: wait forever).
+
+        Returns:
+            True after a debounced change, False on timeout.
+        """
+        deadline = monotonic() + timeout if timeout is not None else None
+        while deadline is None or monotonic() < deadline:
+            if self._observer is None:
+                self._poll()
+            with self._lock:
+                if self._last_change is not None and monotonic() - self._last_change >= self.debounce:
+                    self._last_change = None
+                    return True
+            if self._observer is not None:
+                self._changed.wait(self.interval)
+                self._changed.clear()
+            else:
+                sleep(self.interval)
+        return False
+
+    def stop(self) -> None:
+        """
+        Stops the filesystem observer, if any.
+        """
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
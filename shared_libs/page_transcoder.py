@@ -0,0 +1,202 @@
+import io
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable, Iterator, Optional, Tuple
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+FORMATS = {
+    'jpeg': ('JPEG', '.jpg'),
+    'png': ('PNG', '.png'),
+    'webp': ('WEBP', '.webp'),
+}
+
+
+def transcode_image(data: bytes, image_format: str, max_size: Tuple[int, int], quality: int) -> Tuple[bytes, bool]:
+    """
+    Downscales and re-encodes one page image.
+
+    Encoding options are fixed and no metadata is carried over, so the same input
+    always produces the same bytes.
+
+    Args:
+        data: Source image bytes.
+        image_format: Target format key from `FORMATS` ('jpeg', 'png' or 'webp').
+        max_size: Maximum (width, height); the aspect ratio is preserved.
+        quality: Lossy encoder quality (1-100).
+
+    Returns:
+        Tuple of (image bytes, transcoded). If re-encoding would not shrink an image
+        that is already in the target format and size, or Pillow cannot decode the
+        page, the original bytes are kept.
+    """
+    pil_format, _ = FORMATS[image_format]
+    try:
+        return _transcode_image(data, pil_format, max_size, quality)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return data, False
+
+
+def _transcode_image(data: bytes, pil_format: str, max_size: Tuple[int, int], quality: int) -> Tuple[bytes, bool]:
+    with Image.open(io.BytesIO(data)) as image:
+        source_format = image.format
+        resized = image.width > max_size[0] or image.height > max_size[1]
+        if pil_format == 'JPEG' and image.mode not in ('L', 'RGB'):
+            image = image.convert('RGB')
+        elif image.mode not in ('L', 'RGB', 'RGBA') and (resized or image.mode != 'P'):
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        if resized:
+            image = image.copy()
+            image.thumbnail(max_size, Image.Resampling.LANCZOS)
+
+        out = io.BytesIO()
+        if pil_format == 'JPEG':
+            image.save(out, 'JPEG', quality=quality, optimize=True, subsampling=2)
+        elif pil_format == 'WEBP':
+            image.save(out, 'WEBP', quality=quality, method=6)
+        else:
+            image.save(out, 'PNG', optimize=True)
+
+    if not resized and source_format == pil_format and out.tell() >= len(data):
+        return data, False
+    return out.getvalue(), True
+
+
+def make_thumbnail(data: bytes, size: int = 300, quality: int = 85) -> bytes:
+    """
+    Renders a cover image as a JPEG thumbnail the way Komga sizes its own.
+
+    Args:
+        data: Cover image bytes.
+        size: Maximum width and height in pixels; the aspect ratio is preserved.
+        quality: JPEG quality (1-100).
+
+    Returns:
+        The thumbnail's JPEG bytes.
+
+    Raises:
+        RuntimeError: If Pillow is not installed.
+    """
+    if Image is None:
+        raise RuntimeError('Pillow is required for thumbnails (pip install pillow)')
+    with Image.open(io.BytesIO(data)) as image:
+        image = image.convert('RGB') if image.mode != 'RGB' else image.copy()
+        image.thumbnail((size, size), Image.Resampling.LANCZOS)
+        out = io.BytesIO()
+        image.save(out, 'JPEG', quality=quality, optimize=True)
+    return out.getvalue()
+
+
+def _transcode_job(args: Tuple[bytes, str, Tuple[int, int], int]) -> Tuple[bytes, bool]:
+    return transcode_image(*args)
+
+
+class PageTranscoder:
+    """
+    Transcodes the pages of a volume across a process pool.
+
+    Pages go in and come out in order, and at most `memory_limit` bytes of source
+    images are queued or in flight at once, so a volume of huge scans does not
+    have to fit in memory. With a single worker pages are transcoded inline, which
+    is what per-volume worker processes should use.
+    """
+
+    def __init__(
+        self,
+        image_format: str = 'jpeg',
+        max_width: int = 1600,
+        max_height: int = 2560,
+        quality: int = 85,
+        workers: int = 0,
+        memory_limit: int = 256 * 1024 * 1024,
+        debug_hook: Optional[Callable[[str, int], None]] = None,
+    ):
+        """
+        Args:
+            image_format: Target format key from `FORMATS`.
+            max_width: Maximum page width in pixels.
+            max_height: Maximum page height in pixels.
+            quality: Lossy encoder quality (1-100).
+            workers: Number of worker processes (0 = one per CPU, 1 = inline).
+            memory_limit: Maximum bytes of source images queued at once per volume.
+            debug_hook: Optional callable to log debug info (e.g. `debugger.log`).
+
+        Raises:
+            RuntimeError: If Pillow is not installed.
+            ValueError: If the format is unknown.
+        """
+        if Image is None:
+            raise RuntimeError('Pillow is required for page transcoding (pip install pillow)')
+        if image_format not in FORMATS:
+            raise ValueError(f"Unknown image format '{image_format}', expected one of {sorted(FORMATS)}")
+        self.image_format = image_format
+        self.suffix = FORMATS[image_format][1]
+        self.max_size = (max_width, max_height)
+        self.quality = quality
+        self.workers = workers or os.cpu_count() or 1
+        self.memory_limit = memory_limit
+        self._debug = debug_hook
+        self._pool = None
+
+    def _log(self, msg: str, level: int = 1) -> None:
+        if self._debug:
+            self._debug(msg, level)
+
+    def transcode(self, pages: Iterable[Tuple[str, int, Callable[[], bytes]]]) \
+            -> Iterator[Tuple[str, bytes, int, bool]]:
+        """
+        Transcodes pages in parallel, yielding them in input order.
+
+        Args:
+            pages: (name, size, loader) triples; size is the source image's byte count and
+                each loader returns its bytes. A loader is only called once a page of that
+                size fits in the memory budget (a single page larger than the budget is
+                still loaded, once nothing else is queued).
+
+        Yields:
+            Tuples of (name, image bytes, source size, transcoded).
+        """
+        if self.workers == 1:
+            for name, _, loader in pages:
+                data = loader()
+                image, transcoded = transcode_image(data, self.image_format, self.max_size, self.quality)
+                yield name, image, len(data), transcoded
+            return
+
+        if self._pool is None:
+            self._log(f"Starting {self.workers} transcode workers", 2)
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+
+        queued = deque()
+        queued_bytes = 0
+        for name, size, loader in pages:
+            while queued and queued_bytes + size > self.memory_limit:
+                done_name, future, done_size = queued.popleft()
+                queued_bytes -= done_size
+                yield (done_name, *self._result(future, done_size))
+            data = loader()
+            queued.append((name, self._pool.submit(
+                _transcode_job, (data, self.image_format, self.max_size, self.quality)), len(data)))
+            queued_bytes += len(data)
+
+        while queued:
+            done_name, future, size = queued.popleft()
+            yield (done_name, *self._result(future, size))
+
+    @staticmethod
+    def _result(future, size: int) -> Tuple[bytes, int, bool]:
+        data, transcoded = future.result()
+        return data, size, transcoded
+
+    def close(self) -> None:
+        """
+        Shuts down the worker processes.
+        """
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
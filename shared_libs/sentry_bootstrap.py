@@ -12,6 +12,8 @@ except ImportError:
 
 sentry_sdk = _sentry_sdk  # expose for tests
 
+DEFAULT_TRACES_SAMPLE_RATE = 0.01
+
 
 def _default_config_path() -> Path:
     """
@@ -26,6 +28,30 @@ def _default_config_path() -> Path:
     return Path("/etc/sentry.d/scripts.toml")
 
 
+def _traces_sample_rate(debug_hook: Optional[Callable[[str], None]] = None) -> float:
+    """
+    Returns the fraction of runs to send performance traces for.
+
+    Args:
+        debug_hook: Optional callable to log debug info.
+
+    Returns:
+        `SENTRY_TRACES_SAMPLE_RATE` from the environment (0.0-1.0), or the default.
+    """
+    value = os.getenv("SENTRY_TRACES_SAMPLE_RATE")
+    if value is None:
+        return DEFAULT_TRACES_SAMPLE_RATE
+    try:
+        rate = float(value)
+    except ValueError:
+        rate = -1.0
+    if not 0.0 <= rate <= 1.0:
+        if debug_hook:
+            debug_hook(f"[Sentry] Ignoring invalid SENTRY_TRACES_SAMPLE_RATE: {value}")
+        return DEFAULT_TRACES_SAMPLE_RATE
+    return rate
+
+
 def init(
     script_override: Optional[str] = None,
     config_path: Optional[str | Path] = None,
@@ -39,7 +65,8 @@ def init(
         script_override: Manually specify the script name (default: stem of sys.argv[0]).
         config_path: Optional path to a TOML config file containing DSNs.
         debug_hook: Optional callable to log debug info (e.g. `debugger.log`).
-        **kwargs: Additional sentry_sdk.init() arguments (e.g., traces_sample_rate)
+        **kwargs: Additional sentry_sdk.init() arguments. traces_sample_rate defaults to
+            `SENTRY_TRACES_SAMPLE_RATE` from the environment, or 1% of runs.
     """
     if sentry_sdk is None:
         if debug_hook:
@@ -59,6 +86,7 @@ def init(
 
     dsn = config.get("script_dsns", {}).get(script_name) or os.getenv("SENTRY_DSN")
     if dsn:
+        kwargs.setdefault("traces_sample_rate", _traces_sample_rate(debug_hook))
         sentry_sdk.init(
             dsn=dsn,
             send_default_pii=True,
@@ -0,0 +1,92 @@
+import io
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+import zipfile
+
+from contextlib import redirect_stdout
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import convert_for_komga as cfk  # noqa: E402
+from benchmarks.generate_corpus import make_library  # noqa: E402
+from shared_libs.conversion_manifest import ConversionManifest  # noqa: E402
+
+
+class ExtractFailureTest(unittest.TestCase):
+    """
+    A volume that fails halfway through an extract-mode conversion must not leave
+    its pages behind for the next volume.
+    """
+
+    def setUp(self):
+        self.work = tempfile.TemporaryDirectory()
+        self.addCleanup(self.work.cleanup)
+        work = Path(self.work.name)
+        self.library = work.joinpath('library')
+        make_library(self.library, 2, volumes_per_series=2)
+        with sqlite3.connect(self.library.joinpath('metadata.db')) as conn:
+            conn.execute('DELETE FROM comments WHERE book = 1')
+
+        self.addCleanup(vars(cfk).update, dict(vars(cfk)))
+        cfk.library_path = self.library.as_posix()
+        cfk.calibre_metadata = None
+        cfk.extract_images = True
+        cfk.skip_komga = True
+        cfk.skip_local = False
+        cfk.temp_folder = work.joinpath('temp').as_posix() + '/'
+        cfk.series_cache.clear()
+        cfk.folder_cache.clear()
+
+        cwd = os.getcwd()
+        os.chdir(work)
+        self.addCleanup(os.chdir, cwd)
+
+    def convert(self, jobs, manifest=None, journal=None):
+        calibre = cfk.dump_calibre()
+        files = [(fmt, book_id) for book_id in sorted(calibre, key=int) for fmt in calibre[book_id]['formats']]
+        with redirect_stdout(io.StringIO()):
+            counts = cfk.convert_all(files, calibre, 'all', 'all', 'user', 'password', False, jobs, manifest,
+                                     journal=journal)
+        return calibre, counts
+
+    def assert_own_pages(self, calibre, book_id):
+        book_data = calibre[book_id]
+        with zipfile.ZipFile(book_data['formats'][0]) as epub:
+            pages = {epub.read(name) for name in epub.namelist() if name.endswith('.jpg')}
+        with zipfile.ZipFile(cfk.get_cbz_path(book_data, cfk.get_manga_series(book_data))) as cbz:
+            images = [cbz.read(name) for name in cbz.namelist() if name.endswith('.jpg')]
+        self.assertTrue(images)
+        self.assertLessEqual(set(images), pages)
+
+    def test_serial(self):
+        calibre, counts = self.convert(1)
+        self.assertEqual({'failed': 1, 'converted': 1}, counts)
+        self.assert_own_pages(calibre, '2')
+
+    def test_resume_retries_failed(self):
+        manifest = ConversionManifest('conversion_state.db')
+        self.addCleanup(manifest.close)
+        manifest.journal_record('run:test', 1, 'failed')
+        manifest.journal_record('run:test', 2, 'converted')
+        _, counts = self.convert(1, manifest, 'run:test')
+        self.assertEqual({'failed': 1, 'resumed': 1}, counts)
+
+    def test_worker(self):
+        calibre = cfk.dump_calibre()
+        cfk.init_worker({'temp_folder': cfk.temp_folder}, calibre)
+        statuses = []
+        for book_id in ['1', '2']:
+            status, output, _, _, _ = cfk.convert_worker(calibre[book_id]['formats'][0], 'all', 'all', 'user',
+                                                         'password', False, book_id=book_id)
+            statuses.append(status)
+            self.assertFalse(os.path.exists(cfk.temp_folder), output)
+        self.assertEqual(['failed', 'converted'], statuses)
+        self.assert_own_pages(calibre, '2')
+
+
+if __name__ == '__main__':
+    unittest.main()